@@ -0,0 +1,46 @@
+"""Compares the stage timings and peak memory of two benchmark result files.
+
+    python -m benchmarks.compare baseline.json candidate.json
+"""
+import sys
+import json
+
+import pandas as pd
+
+
+def stage_frame(path):
+    """Reads a result file into a dataframe with one row per case and stage."""
+    with open(path) as f:
+        results = json.load(f)
+
+    rows = []
+    for case in results['cases']:
+        if 'error' in case:
+            continue
+        keys = {key: case[key] for key in ['pipeline', 'profile', 'rows']}
+        rows.append(dict(keys, stage='total', wall_time=case['wall_time'], peak_rss=case['peak_rss'],
+                         precision=case['precision'], recall=case['recall']))
+        rows.extend(dict(keys, stage=stage['stage'], wall_time=stage['wall_time'],
+                         peak_rss=stage.get('peak_rss', stage.get('process_peak_rss')))
+                    for stage in case['stages'])
+
+    return pd.DataFrame(rows).set_index(['pipeline', 'profile', 'rows', 'stage'])
+
+
+def compare(baseline, candidate):
+    """Joins two result files on case and stage.
+        Returns
+        -------
+        pd.DataFrame
+            The wall time and peak memory of both files, and the ratio of the
+            candidate's wall time to the baseline's.
+    """
+    df = stage_frame(baseline).join(stage_frame(candidate), how='inner',
+                                    lsuffix='_baseline', rsuffix='_candidate')
+    df['speedup'] = df['wall_time_baseline'] / df['wall_time_candidate']
+    return df
+
+
+if __name__ == '__main__':
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(compare(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,156 @@
+"""Seeded generators of synthetic, dirty person records.
+
+Every generated row carries an `entity` column holding the id of the real
+world entity it describes, so results can be scored against the truth. The
+column is never used for matching.
+"""
+import numpy as np
+import pandas as pd
+
+
+SYLLABLES = ['an', 'ber', 'car', 'dan', 'el', 'fer', 'gar', 'hol', 'is', 'jo',
+             'kar', 'lin', 'mar', 'nor', 'ol', 'per', 'quin', 'ros', 'sam', 'tor',
+             'ul', 'van', 'wil', 'xan', 'yor', 'zel', 'bre', 'cla', 'dro', 'fra']
+STREETS = ['main st', 'oak ave', 'park rd', 'high st', 'mill ln', 'church rd',
+           'elm st', 'lake dr', 'hill rd', 'river rd', 'king st', 'station rd']
+
+# The columns of each profile, as passed to field_properties
+PROFILES = {
+    'names': ['first_name', 'last_name'],
+    'strings': ['first_name', 'last_name', 'address', 'city'],
+    'mixed': ['first_name', 'last_name', 'city', ('salary', 'Price'), ('loc', 'LatLong')],
+    # gazetteer_dataframe matches on a single column
+    'fullname': ['fullname'],
+}
+
+
+def _words(rng, n, min_syllables, max_syllables):
+    """Internal method that draws n made up words of a few syllables each."""
+    lengths = rng.integers(min_syllables, max_syllables + 1, n)
+    syllables = np.array(SYLLABLES)[rng.integers(0, len(SYLLABLES), (n, max_syllables))]
+    return [''.join(row[:length]) for row, length in zip(syllables, lengths)]
+
+
+def _entities(rng, n):
+    """Internal method that draws n clean entities."""
+    n_cities = max(n // 2000, 10)
+    cities = np.array(_words(rng, n_cities, 2, 3), dtype=object)
+    centers = rng.uniform([-60, -180], [60, 180], (n_cities, 2))
+    city = rng.integers(0, n_cities, n)
+    loc = centers[city] + rng.normal(0, 0.05, (n, 2))
+
+    return pd.DataFrame({
+        'first_name': _words(rng, n, 2, 3),
+        'last_name': _words(rng, n, 2, 4),
+        'address': [str(number) + ' ' + street for number, street in zip(
+            rng.integers(1, 400, n), np.array(STREETS)[rng.integers(0, len(STREETS), n)])],
+        'city': cities[city],
+        'salary': rng.integers(15, 250, n) * 1000,
+        'loc': list(zip(loc[:, 0].round(4), loc[:, 1].round(4))),
+    })
+
+
+def _typo(rng, value):
+    """Internal method that deletes, swaps or replaces one character."""
+    if len(value) < 4:
+        return value
+    i = int(rng.integers(1, len(value) - 1))
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        return value[:i] + value[i + 1:]
+    if kind == 1:
+        return value[:i - 1] + value[i] + value[i - 1] + value[i + 1:]
+    return value[:i] + SYLLABLES[int(rng.integers(0, len(SYLLABLES)))][0] + value[i + 1:]
+
+
+def _render(rng, entities, dirty):
+    """Internal method that formats entities the way they appear in a source
+        table, corrupting the rows flagged as dirty.
+    """
+    rows = {column: [] for column in ['first_name', 'last_name', 'fullname', 'address', 'city', 'salary', 'loc']}
+    for record, is_dirty in zip(entities.itertuples(index=False), dirty):
+        first, last, address, city = record.first_name, record.last_name, record.address, record.city
+        salary, (lat, lng) = record.salary, record.loc
+        if is_dirty:
+            noise = rng.random(8)
+            first = _typo(rng, first) if noise[0] < 0.4 else first
+            last = _typo(rng, last) if noise[1] < 0.3 else last
+            address = address.replace(' st', ' street') if noise[2] < 0.3 else address
+            salary = salary + int(rng.integers(-5, 6)) * 100 if noise[3] < 0.3 else salary
+            lat, lng = (lat + rng.normal(0, 0.001), lng + rng.normal(0, 0.001)) if noise[4] < 0.5 else (lat, lng)
+            first = first.upper() if noise[5] < 0.2 else first.title()
+            city = None if noise[6] < 0.05 else city
+            last = last + '.' if noise[7] < 0.1 else last
+        else:
+            first = first.title()
+
+        rows['first_name'].append(first)
+        rows['last_name'].append(last.title())
+        rows['fullname'].append(first + ' ' + last.title())
+        rows['address'].append(address)
+        rows['city'].append(city)
+        rows['salary'].append('$' + format(salary, ','))
+        rows['loc'].append('(%.4f, %.4f)' % (lat, lng))
+
+    return pd.DataFrame(rows)
+
+
+def _with_duplicates(rng, entities, n, duplicate_rate):
+    """Internal method that draws n rows: one clean row for each of the first
+        n * (1 - duplicate_rate) entities, and dirty copies of them for the
+        rest, in random order.
+    """
+    n_unique = max(int(round(n * (1 - duplicate_rate))), 1)
+    entity = np.concatenate([np.arange(n_unique), rng.integers(0, n_unique, n - n_unique)])
+    dirty = np.arange(n) >= n_unique
+    order = rng.permutation(n)
+    entity, dirty = entity[order], dirty[order]
+
+    df = _render(rng, entities.iloc[entity], dirty)
+    df['entity'] = entity
+    return df
+
+
+def dedupe_frame(n, duplicate_rate=0.3, seed=0):
+    """Generates a table of people with duplicates.
+        Parameters
+        ----------
+        n : int
+            The number of rows.
+        duplicate_rate : float, default 0.3
+            The fraction of rows that are dirty copies of another row.
+        seed : int, default 0
+            The random seed. The same seed always generates the same table.
+        Returns
+        -------
+        pd.DataFrame
+            The rows, with an entity column holding the true entity ids.
+    """
+    rng = np.random.default_rng(seed)
+    entities = _entities(rng, n)
+    return _with_duplicates(rng, entities, n, duplicate_rate)
+
+
+def linked_frames(n, duplicate_rate=0.3, seed=0):
+    """Generates a clean table of people and a messy table of n rows, of
+        which duplicate_rate are dirty copies of rows of the clean table.
+        Returns
+        -------
+        tuple
+            The clean and messy dataframes, with entity columns holding the
+            true entity ids.
+    """
+    rng = np.random.default_rng(seed)
+    n_matched = int(round(n * duplicate_rate))
+    entities = _entities(rng, 2 * n - n_matched)
+
+    clean = _render(rng, entities.iloc[:n], np.zeros(n, dtype=bool))
+    clean['entity'] = np.arange(n)
+
+    # Matched rows come from the clean table, the others are new entities
+    entity = np.concatenate([rng.choice(n, n_matched, replace=False), np.arange(n, 2 * n - n_matched)])
+    entity = entity[rng.permutation(n)]
+    messy = _render(rng, entities.iloc[entity], np.ones(n, dtype=bool))
+    messy['entity'] = entity
+
+    return clean, messy
@@ -0,0 +1,222 @@
+"""Runs the entry points on generated data and records the time, throughput
+and peak memory of every pipeline stage.
+
+    python -m benchmarks.run --sizes 10000 100000 1000000 --output results.json
+
+Every case runs in a fresh process, so peak memory is that of the case
+alone. Results are written as JSON; compare two files with
+python -m benchmarks.compare.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+import multiprocessing
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+import pandas_dedupe
+from pandas_dedupe.instrumentation import PipelineStats
+
+from benchmarks.generators import PROFILES, dedupe_frame, linked_frames
+from benchmarks.settings import config_name, ensure_settings, profiles
+
+
+PIPELINES = ['dedupe', 'link', 'gazetteer']
+SIZES = [10000, 100000, 1000000]
+
+
+def _pairs(counts):
+    """Internal method that counts the pairs within groups of the given sizes."""
+    counts = np.asarray(counts, dtype=np.int64)
+    return int((counts * (counts - 1) // 2).sum())
+
+
+def pairwise_scores(cluster_ids, entities):
+    """Scores clusters against the true entities.
+        Returns
+        -------
+        tuple
+            The pairwise precision and recall. Rows without a cluster id
+            are singletons.
+    """
+    df = pd.DataFrame({'cluster': cluster_ids, 'entity': entities})
+    df['cluster'] = df['cluster'].fillna(pd.Series(-1 - np.arange(len(df)), index=df.index))
+
+    found = _pairs(df.groupby('cluster').size())
+    true = _pairs(df.groupby('entity').size())
+    correct = _pairs(df.groupby(['cluster', 'entity']).size())
+
+    precision = correct / found if found else 1.0
+    recall = correct / true if true else 1.0
+    return precision, recall
+
+
+def _run_case(pipeline, profile, rows, duplicate_rate, seed, n_cores):
+    """Internal method that runs one entry point on generated data."""
+    field_properties = PROFILES[profile]
+    columns = [field if isinstance(field, str) else field[0] for field in field_properties]
+    stats = PipelineStats()
+
+    if pipeline == 'dedupe':
+        df = dedupe_frame(rows, duplicate_rate, seed)
+        start = time.perf_counter()
+        results = pandas_dedupe.dedupe_dataframe(
+            df[columns], field_properties, config_name=config_name(pipeline, profile),
+            n_cores=n_cores, stats=stats)
+        wall_time = time.perf_counter() - start
+        cluster_ids, entities = results['cluster id'], df['entity']
+        n_records = rows
+    else:
+        clean, messy = linked_frames(rows, duplicate_rate, seed)
+        start = time.perf_counter()
+        if pipeline == 'link':
+            results = pandas_dedupe.link_dataframes(
+                clean[columns], messy[columns], field_properties,
+                config_name=config_name(pipeline, profile), n_cores=n_cores, stats=stats)
+            wall_time = time.perf_counter() - start
+            # Unmatched rows of both tables are appended without a cluster id
+            entities = pd.concat([clean['entity'], messy['entity']], ignore_index=True)
+            cluster_ids = results['cluster id']
+            entities = entities.loc[results.index]
+        else:
+            results = pandas_dedupe.gazetteer_dataframe(
+                clean[columns], messy[columns], field_properties[0],
+                config_name=config_name(pipeline, profile), n_cores=n_cores, stats=stats)
+            wall_time = time.perf_counter() - start
+            # Gazetteer cluster ids are gazette row numbers, which are entity ids
+            cluster_ids, entities = results['cluster id'], messy['entity']
+        n_records = 2 * rows
+
+    if pipeline == 'gazetteer':
+        matched = cluster_ids.notna()
+        correct = int((cluster_ids[matched] == entities[matched]).sum())
+        true = int((entities < rows).sum())
+        precision = correct / matched.sum() if matched.sum() else 1.0
+        recall = correct / true if true else 1.0
+    else:
+        precision, recall = pairwise_scores(cluster_ids.to_numpy(), entities.to_numpy())
+
+    stages = []
+    for record in stats.stages:
+        record = {key: value for key, value in record.items() if value is not None}
+        record['records_per_second'] = n_records / record['wall_time'] if record['wall_time'] else None
+        stages.append(record)
+
+    return {
+        'pipeline': pipeline,
+        'profile': profile,
+        'rows': rows,
+        'fields': len(field_properties),
+        'duplicate_rate': duplicate_rate,
+        'wall_time': wall_time,
+        'records_per_second': n_records / wall_time,
+        'peak_rss': max((record.get('peak_rss') or record.get('process_peak_rss') or 0
+                         for record in stages), default=None),
+        'precision': float(precision),
+        'recall': float(recall),
+        'stages': stages,
+    }
+
+
+def _case_process(connection, *args):
+    """Internal method that runs a case in a child process and sends the
+        result, or the error, back through connection.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        connection.send(_run_case(*args))
+    except Exception as e:
+        connection.send({'error': repr(e)})
+    connection.close()
+
+
+def run_case(*args):
+    """Runs one case in a fresh process, so its peak memory is its own."""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_case_process, args=(sender,) + args)
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': 'exit code %s' % process.exitcode}
+    process.join()
+    return result
+
+
+def _version(package):
+    """Internal method that returns the installed version of a package."""
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _git_commit():
+    """Internal method that returns the commit of the working tree."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment(args):
+    """Describes the machine, the package versions and the run arguments."""
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': _git_commit(),
+        'pandas_dedupe': _version('pandas_dedupe'),
+        'dedupe': _version('dedupe'),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': vars(args),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=PIPELINES)
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=['mixed', 'fullname'],
+                        help='gazetteer only runs the fullname profile, the others all but fullname')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--duplicate-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-cores', type=int, default=None)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(args), 'cases': []}
+    cases = [(pipeline, profile, rows) for pipeline, rows in itertools.product(args.pipelines, args.sizes)
+             for profile in args.profiles if profile in profiles(pipeline)]
+    for pipeline, profile, rows in cases:
+        ensure_settings(pipeline, profile)
+        print('%s %s %d rows ...' % (pipeline, profile, rows), flush=True)
+        result = run_case(pipeline, profile, rows, args.duplicate_rate, args.seed, args.n_cores)
+        result.update({'pipeline': pipeline, 'profile': profile, 'rows': rows})
+        results['cases'].append(result)
+        print('  ' + (result['error'] if 'error' in result else
+                      '%.1fs, %.0f records/s, peak %.0f MB' % (
+                          result['wall_time'], result['records_per_second'],
+                          (result['peak_rss'] or 0) / 2**20)), flush=True)
+
+        # Write after every case, so long runs keep partial results
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=float)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
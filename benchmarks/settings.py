@@ -0,0 +1,127 @@
+"""Builds the settings files the benchmarks load, so no console labeling is
+needed. Models are trained on a small generated sample, labeling pairs from
+the true entity ids.
+
+    python -m benchmarks.settings
+"""
+import os
+
+import dedupe
+import numpy as np
+
+from pandas_dedupe.utility_functions import clean_punctuation, field_names, select_fields, specify_type
+from pandas_dedupe.records import records_from_dataframe
+
+from benchmarks.generators import PROFILES, dedupe_frame, linked_frames
+
+
+def profiles(pipeline):
+    """Returns the profiles a pipeline can run."""
+    if pipeline == 'gazetteer':
+        return ['fullname']
+    return [profile for profile in PROFILES if profile != 'fullname']
+
+
+SETTINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings')
+TRAINING_ROWS = 2000
+LABELS = 100
+
+
+def config_name(pipeline, profile):
+    """Returns the config_name that loads the settings of a pipeline and profile."""
+    return os.path.join(SETTINGS_DIR, '%s_%s' % (pipeline, profile))
+
+
+def _records(df, field_properties, prefix=''):
+    """Internal method that prepares records the way the entry points do."""
+    df = clean_punctuation(df)
+    specify_type(df, field_properties)
+    df.index = [prefix + str(i) for i in df.index] if prefix else df.index
+    return records_from_dataframe(df, field_names(field_properties)), df['entity'].to_numpy()
+
+
+def _labels(rng, records_1, entity_1, records_2, entity_2):
+    """Internal method that labels matching pairs of entities and random
+        distinct pairs.
+    """
+    keys_1, keys_2 = list(records_1), list(records_2)
+    by_entity = {}
+    for key, entity in zip(keys_2, entity_2):
+        by_entity.setdefault(entity, []).append(key)
+
+    match = []
+    for key, entity in zip(keys_1, entity_1):
+        match.extend((records_1[key], records_2[other]) for other in by_entity.get(entity, [])
+                     if other != key)
+        if len(match) >= LABELS:
+            break
+
+    distinct = []
+    for i, j in zip(rng.integers(0, len(keys_1), 10 * LABELS), rng.integers(0, len(keys_2), 10 * LABELS)):
+        if entity_1[i] != entity_2[j]:
+            distinct.append((records_1[keys_1[i]], records_2[keys_2[j]]))
+        if len(distinct) >= LABELS:
+            break
+
+    return {'match': match[:LABELS], 'distinct': distinct}
+
+
+def build_settings(pipeline, profile, seed=0):
+    """Trains the model of a pipeline and profile and writes its settings file.
+        Parameters
+        ----------
+        pipeline : str
+            One of dedupe, link or gazetteer.
+        profile : str
+            A key of benchmarks.generators.PROFILES.
+        seed : int, default 0
+            The random seed of the training data.
+        Returns
+        -------
+        str
+            The path of the settings file.
+    """
+    rng = np.random.default_rng(seed)
+    field_properties = PROFILES[profile]
+    fields = []
+    select_fields(fields, field_properties)
+
+    if pipeline == 'dedupe':
+        data, entity = _records(dedupe_frame(TRAINING_ROWS, 0.5, seed), field_properties)
+        model = dedupe.Dedupe(fields, num_cores=0)
+        # Labels marked before prepare_training are indexed by the active learner
+        model.mark_pairs(_labels(rng, data, entity, data, entity))
+        model.prepare_training(data, sample_size=TRAINING_ROWS)
+    else:
+        clean, messy = linked_frames(TRAINING_ROWS, 0.5, seed)
+        data_1, entity_1 = _records(clean, field_properties, 'dfa' if pipeline == 'link' else '')
+        offset = 0 if pipeline == 'link' else len(clean)
+        messy.index = messy.index + offset
+        data_2, entity_2 = _records(messy, field_properties, 'dfb' if pipeline == 'link' else '')
+        model_class = dedupe.RecordLink if pipeline == 'link' else dedupe.Gazetteer
+        model = model_class(fields, num_cores=0)
+        model.mark_pairs(_labels(rng, data_1, entity_1, data_2, entity_2))
+        model.prepare_training(data_1, data_2, sample_size=TRAINING_ROWS)
+
+    model.train()
+
+    settings_file = config_name(pipeline, profile) + '_learned_settings'
+    os.makedirs(SETTINGS_DIR, exist_ok=True)
+    with open(settings_file, 'wb') as f:
+        model.write_settings(f)
+
+    return settings_file
+
+
+def ensure_settings(pipeline, profile):
+    """Builds the settings file of a pipeline and profile unless it exists."""
+    settings_file = config_name(pipeline, profile) + '_learned_settings'
+    if not os.path.exists(settings_file):
+        build_settings(pipeline, profile)
+    return settings_file
+
+
+if __name__ == '__main__':
+    for pipeline in ['dedupe', 'link', 'gazetteer']:
+        for profile in profiles(pipeline):
+            print(build_settings(pipeline, profile))
@@ -1,3 +1,5 @@
 from pandas_dedupe.dedupe_dataframe import dedupe_dataframe
 from pandas_dedupe.link_dataframes import link_dataframes
-from pandas_dedupe.gazetteer_dataframe import gazetteer_dataframe
+from pandas_dedupe.gazetteer_dataframe import gazetteer_dataframe, gazetteer_dataframe_chunks
+from pandas_dedupe.session import DedupeSession, LinkSession, GazetteerSession
+from pandas_dedupe.matcher import GazetteerMatcher
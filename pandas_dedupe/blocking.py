@@ -0,0 +1,198 @@
+import logging
+from collections import Counter
+from contextlib import contextmanager
+
+import dedupe
+import numpy as np
+import pandas as pd
+
+from pandas_dedupe.utility_functions import (
+    clean_punctuation,
+    field_names,
+    model_field_properties,
+    specify_type
+)
+from pandas_dedupe.records import records_from_dataframe
+
+
+def block_sizes(deduper, data):
+    """Counts the records in every block the learned predicates produce.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            A trained instance of dedupe.
+        data : dict
+            The dedupe formatted data dictionary.
+        Returns
+        -------
+        collections.Counter
+            The number of records of every block key.
+    """
+    deduper.fingerprinter.index_all(data)
+    sizes = Counter(block_key for block_key, _ in deduper.fingerprinter(data.items()))
+    deduper.fingerprinter.reset_indices()
+    return sizes
+
+
+def size_histogram(sizes):
+    """Buckets block sizes by powers of two.
+        Returns
+        -------
+        dict
+            The number of blocks per bucket, keyed by the smallest block size
+            of the bucket (1, 2, 4, 8, ...).
+    """
+    histogram = Counter(1 << (size.bit_length() - 1) for size in sizes.values())
+    return dict(sorted(histogram.items()))
+
+
+def blocking_report(deduper, sizes, n_records, top=10):
+    """Summarizes block sizes.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            The trained instance of dedupe the blocks were produced with.
+        sizes : collections.Counter
+            The number of records of every block key, see block_sizes.
+        n_records : int
+            The number of records that were blocked.
+        top : int, default 10
+            The number of largest blocks to list.
+        Returns
+        -------
+        dict
+            records : the number of records.
+            blocks : the number of blocks.
+            comparisons : the number of record pairs within blocks, an upper
+                bound of the pairs dedupe scores, as pairs that share several
+                blocks are only scored once.
+            histogram : the number of blocks per power of two block size.
+            predicates : a dataframe of the blocks, records, largest block and
+                comparisons of every predicate, most comparisons first.
+            largest_blocks : a dataframe of the top largest blocks.
+    """
+    blocks = pd.DataFrame({'block key': list(sizes.keys()),
+                           'size': np.fromiter(sizes.values(), dtype=np.int64, count=len(sizes))})
+    # Block keys end with ':' and the index of the predicate that produced them
+    blocks['predicate'] = blocks['block key'].str.rsplit(':', n=1).str[1].astype(int)
+    blocks['comparisons'] = blocks['size'] * (blocks['size'] - 1) // 2
+
+    predicates = (blocks
+                  .groupby('predicate')
+                  .agg(blocks=('size', 'size'), records=('size', 'sum'),
+                       largest_block=('size', 'max'), comparisons=('comparisons', 'sum'))
+                  .sort_values('comparisons', ascending=False))
+    names = [str(predicate) for predicate in deduper.predicates]
+    predicates.index = [names[i] for i in predicates.index]
+
+    largest_blocks = blocks.nlargest(top, 'size')
+    largest_blocks['predicate'] = [names[i] for i in largest_blocks['predicate']]
+
+    return {
+        'records': n_records,
+        'blocks': len(blocks),
+        'comparisons': int(blocks['comparisons'].sum()),
+        'histogram': size_histogram(sizes),
+        'predicates': predicates,
+        'largest_blocks': largest_blocks.reset_index(drop=True),
+    }
+
+
+def analyze_blocking(settings_file, df, top=10):
+    """Reports the blocks the predicates of a settings file produce on a
+        dataframe, before anything is scored.
+
+        The dataframe is cleaned and typed like dedupe_dataframe does, using
+        the fields and types stored in the settings file, and blocked as a
+        single dataset.
+        Parameters
+        ----------
+        settings_file : str
+            A path to a settings file written by any of the entry points.
+        df : pd.DataFrame
+            The dataframe to block. It must hold the fields of the model.
+        top : int, default 10
+            The number of largest blocks to list.
+        Returns
+        -------
+        dict
+            The block size distribution, estimated comparisons and worst
+            predicates, see blocking_report.
+    """
+    with open(settings_file, 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=0)
+
+    field_properties = model_field_properties(deduper)
+    fields = field_names(field_properties)
+
+    df = clean_punctuation(df[fields])
+    specify_type(df, field_properties)
+    data = records_from_dataframe(df, fields, lazy=True)
+
+    return blocking_report(deduper, block_sizes(deduper, data), len(data), top)
+
+
+class _CappedFingerprinter(object):
+    """Wraps a fingerprinter, splitting or skipping the given block keys."""
+
+    def __init__(self, fingerprinter, oversized, max_block_size, split):
+        self._fingerprinter = fingerprinter
+        self._oversized = oversized
+        self._max_block_size = max_block_size
+        self._split = split
+
+    def __getattr__(self, name):
+        return getattr(self._fingerprinter, name)
+
+    def __call__(self, records, target=False):
+        seen = Counter()
+        for block_key, record_id in self._fingerprinter(records, target):
+            if block_key in self._oversized:
+                if not self._split:
+                    continue
+                part = seen[block_key] // self._max_block_size
+                seen[block_key] += 1
+                block_key = '%s/%d' % (block_key, part)
+            yield block_key, record_id
+
+
+@contextmanager
+def cap_blocks(deduper, sizes, max_block_size=None, oversized_blocks='split'):
+    """Limits the size of the blocks deduper compares records in while the
+        context is active.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            A trained instance of dedupe.
+        sizes : collections.Counter
+            The number of records of every block key, see block_sizes.
+        max_block_size : int, default None
+            The largest block to compare as is. If None, nothing is capped.
+        oversized_blocks : str, default 'split'
+            'split' breaks larger blocks into blocks of max_block_size records,
+            'skip' drops them. Pairs that only share an oversized block are
+            then not compared, or only compared within the same part.
+    """
+    if oversized_blocks not in ('split', 'skip'):
+        raise ValueError("oversized_blocks must be 'split' or 'skip'")
+
+    oversized = set()
+    if max_block_size:
+        oversized = {block_key for block_key, size in sizes.items() if size > max_block_size}
+
+    if not oversized:
+        yield
+        return
+
+    largest = max(sizes[block_key] for block_key in oversized)
+    logging.warning('%d blocks hold more than %d records, the largest %d. %s them before scoring.',
+                    len(oversized), max_block_size, largest,
+                    'Splitting' if oversized_blocks == 'split' else 'Skipping')
+
+    original = deduper._fingerprinter
+    deduper._fingerprinter = _CappedFingerprinter(original, oversized, max_block_size,
+                                                  oversized_blocks == 'split')
+    try:
+        yield
+    finally:
+        deduper._fingerprinter = original
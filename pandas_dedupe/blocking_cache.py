@@ -0,0 +1,160 @@
+import os
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from pandas_dedupe.utility_functions import record_digest, settings_digest, static_predicates
+
+
+def _load_cache(cache_file, settings_hash):
+    """Internal method that reads the cached block keys.
+        Returns
+        -------
+        dict
+            The {record hash: block keys} cache, empty if there is no cache
+            built with the same settings file.
+    """
+    if not os.path.exists(cache_file):
+        return {}
+
+    try:
+        with np.load(cache_file, allow_pickle=False) as f:
+            if str(f['settings_hash']) != settings_hash:
+                return {}
+            record_hashes = f['record_hashes'].tobytes()
+            offsets = f['offsets']
+            key_codes = f['key_codes']
+            vocabulary_offsets = f['vocabulary_offsets']
+            vocabulary_blob = f['vocabulary'].tobytes()
+    except Exception:
+        logging.warning('Could not read the blocking key cache in %s, rebuilding it', cache_file)
+        return {}
+
+    vocabulary = [vocabulary_blob[start:end].decode('utf-8')
+                  for start, end in zip(vocabulary_offsets[:-1].tolist(), vocabulary_offsets[1:].tolist())]
+    keys = [vocabulary[code] for code in key_codes.tolist()]
+    offsets = offsets.tolist()
+
+    return {record_hashes[16 * i:16 * (i + 1)]: keys[start:end]
+            for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]))}
+
+
+def _save_cache(cache, cache_file, settings_hash):
+    """Internal method that writes the {record hash: block keys} cache as
+        columns: the 16 byte record hashes, the offsets of every record's
+        keys, and the keys as codes into a vocabulary of distinct block keys.
+    """
+    vocabulary = {}
+    key_codes = []
+    offsets = [0]
+    for keys in cache.values():
+        key_codes.extend(vocabulary.setdefault(key, len(vocabulary)) for key in keys)
+        offsets.append(len(key_codes))
+
+    encoded = [key.encode('utf-8') for key in vocabulary]
+    vocabulary_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(key) for key in encoded], out=vocabulary_offsets[1:])
+
+    # Written next to the cache first, so a partially written cache is never read
+    temp_file = cache_file + '.tmp.npz'
+    np.savez(temp_file,
+             settings_hash=np.array(settings_hash),
+             record_hashes=np.frombuffer(b''.join(cache), dtype=np.uint8).reshape(-1, 16),
+             offsets=np.array(offsets, dtype=np.int64),
+             key_codes=np.array(key_codes, dtype=np.int32),
+             vocabulary_offsets=vocabulary_offsets,
+             vocabulary=np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    os.replace(temp_file, cache_file)
+
+
+class _CachedFingerprinter(object):
+    """Wraps a fingerprinter, reading the keys of the predicates that only
+        depend on the record from the cache and computing the others.
+    """
+
+    def __init__(self, fingerprinter, fields, cache):
+        self._fingerprinter = fingerprinter
+        self._fields = fields
+        self._cache = cache
+        self.seen = {}
+        self.hits = 0
+
+        # Predicates that use an index of the data are never cached
+        static = set(static_predicates(fingerprinter))
+        self._predicates = [(':' + str(i), predicate, i in static)
+                            for i, predicate in enumerate(fingerprinter.predicates)]
+
+    def __getattr__(self, name):
+        return getattr(self._fingerprinter, name)
+
+    def __call__(self, records, target=False):
+        if target:
+            yield from self._fingerprinter(records, target)
+            return
+
+        for record_id, record in records:
+            record_hash = record_digest(record, self._fields)
+            cached = self.seen.get(record_hash)
+            if cached is None:
+                cached = self._cache.get(record_hash)
+                if cached is not None:
+                    self.hits += 1
+
+            static_keys = []
+            for pred_id, predicate, is_static in self._predicates:
+                if is_static and cached is not None:
+                    continue
+                for block_key in predicate(record, target=False):
+                    if is_static:
+                        static_keys.append(block_key + pred_id)
+                    else:
+                        yield block_key + pred_id, record_id
+
+            if cached is None:
+                cached = static_keys
+            self.seen[record_hash] = cached
+            for block_key in cached:
+                yield block_key, record_id
+
+
+@contextmanager
+def cached_blocking(deduper, fields, settings_file, cache_file):
+    """Reuses the block keys of records that were blocked before with the same
+        settings file while the context is active.
+
+        Records are identified by a hash of their values in fields, so a
+        record that changed is blocked again. When the context exits, the keys
+        of the records blocked inside it are merged into the cache, so a run
+        over part of the data keeps the keys of the other records.
+
+        Only predicates without an index part are cached. A compound
+        predicate with any index part, such as a canopy or search predicate
+        combined with a simple one, is evaluated on every run, so models
+        made only of such predicates gain almost nothing from the cache.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            A trained instance of dedupe.
+        fields : list
+            The fields the predicates of deduper read.
+        settings_file : str
+            A path to the settings file of deduper.
+        cache_file : str
+            The path of the cache, an .npz file.
+    """
+    settings_hash = settings_digest(settings_file)
+    cache = _load_cache(cache_file, settings_hash)
+
+    original = deduper._fingerprinter
+    fingerprinter = _CachedFingerprinter(original, fields, cache)
+    deduper._fingerprinter = fingerprinter
+    try:
+        yield
+    finally:
+        deduper._fingerprinter = original
+
+    print('# cached blocking keys', fingerprinter.hits, 'of', len(fingerprinter.seen), 'records')
+    if any(record_hash not in cache for record_hash in fingerprinter.seen):
+        cache.update(fingerprinter.seen)
+        _save_cache(cache, cache_file, settings_hash)
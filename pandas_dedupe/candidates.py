@@ -0,0 +1,259 @@
+"""Candidate generation for the gazetteer from a character n-gram index.
+
+Learned blocking predicates can form huge blocks, or miss true matches, on
+short and noisy values. Instead, the gazette values are indexed as TF-IDF
+weighted character n-grams, and every messy record is compared by the
+trained model with only its most similar gazette records.
+"""
+import pickle
+
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+class NgramIndex(object):
+    """A TF-IDF index of the character n-grams of a gazette column.
+
+        Parameters
+        ----------
+        ngram_range : tuple, default (2, 4)
+            The smallest and largest n-grams indexed. Shorter n-grams find
+            more candidates, longer ones rank them more precisely.
+        max_df : float, default 0.2
+            N-grams found in a larger fraction of the gazette are not indexed.
+            Very common n-grams match most of the gazette while adding little
+            to the ranking, so dropping them keeps queries fast and their
+            memory bounded. On the benchmark gazettes, 0.2 keeps the recall of
+            1.0; lower values trade recall on values made of common n-grams
+            for speed.
+        min_df : int, default 1
+            N-grams found in fewer gazette records are not indexed.
+        min_similarity : float, default 0.0
+            Candidates with a lower cosine similarity are dropped.
+        batch_size : int, default 1000
+            The number of records queried at a time. Larger batches are faster
+            and use more memory.
+        chunk_size : int, default 20000
+            The number of gazette records every batch is compared with at a
+            time. Only the best candidates of every chunk are kept, so memory
+            is bounded by batch_size * chunk_size whatever the gazette size.
+    """
+
+    def __init__(self, ngram_range=(2, 4), max_df=0.2, min_df=1, min_similarity=0.0, batch_size=1000,
+                 chunk_size=20000):
+        self.ngram_range = ngram_range
+        self.max_df = max_df
+        self.min_df = min_df
+        self.min_similarity = min_similarity
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.ids = None
+        self.field = None
+        self._vectorizer = None
+        self._matrix = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    def fit(self, records, field):
+        """Indexes the field of the gazette records.
+            Parameters
+            ----------
+            records : dict
+                The {gazette id: record} gazette records.
+            field : str
+                The field to index.
+            Returns
+            -------
+            NgramIndex
+                The index itself.
+        """
+        self.ids = list(records)
+        self.field = field
+
+        # A fraction of a small gazette can round below min_df, which
+        # TfidfVectorizer rejects
+        max_df = self.max_df
+        if isinstance(max_df, float):
+            max_df = max(int(max_df * len(records)), self.min_df)
+
+        self._vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=self.ngram_range,
+                                           max_df=max_df, min_df=self.min_df, lowercase=False,
+                                           dtype=np.float32)
+        self._matrix = self._vectorizer.fit_transform(
+            [_text(record[field]) for record in records.values()]).tocsr()
+        return self
+
+    def add(self, records):
+        """Indexes more gazette records, without fitting the index again.
+            N-grams are weighted by their frequency in the gazette the index
+            was fitted on, and n-grams it did not hold are ignored. Records
+            with the id of an indexed record replace it.
+            Parameters
+            ----------
+            records : dict
+                The {gazette id: record} gazette records to add.
+        """
+        if not records:
+            return
+        indexed = set(self.ids)
+        self.remove([record_id for record_id in records if record_id in indexed])
+        matrix = self._vectorizer.transform([_text(record[self.field]) for record in records.values()])
+        self._matrix = scipy.sparse.vstack([self._matrix, matrix], format='csr')
+        self.ids.extend(records)
+
+    def remove(self, ids):
+        """Removes gazette records from the index.
+            Parameters
+            ----------
+            ids : iterable
+                The ids of the gazette records to remove.
+        """
+        ids = set(ids)
+        if not ids:
+            return
+        keep = [position for position, record_id in enumerate(self.ids) if record_id not in ids]
+        self._matrix = self._matrix[keep]
+        self.ids = [self.ids[position] for position in keep]
+
+    def query(self, values, k=10):
+        """Finds the gazette records most similar to every value.
+            Parameters
+            ----------
+            values : list
+                The values to look up.
+            k : int, default 10
+                The number of candidates returned per value.
+            Returns
+            -------
+            generator of list
+                The ids of the candidates of every value, most similar first.
+        """
+        for start in range(0, len(values), self.batch_size):
+            batch = self._vectorizer.transform([_text(value) for value in values[start:start + self.batch_size]])
+
+            # The (rows, scores, gazette positions) of the best candidates so far
+            best = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+            for offset in range(0, self._matrix.shape[0], self.chunk_size):
+                similarities = (batch @ self._matrix[offset:offset + self.chunk_size].T).tocsr()
+                best = _merge(best, _top_k(similarities, k, self.min_similarity, offset), k)
+
+            rows, _, positions = best
+            bounds = np.searchsorted(rows, np.arange(batch.shape[0] + 1))
+            for begin, end in zip(bounds[:-1], bounds[1:]):
+                yield [self.ids[position] for position in positions[begin:end]]
+
+    def save(self, path):
+        """Writes the index to a file."""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=4)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def _top_k(similarities, k, min_similarity, offset):
+    """Internal method that keeps the k best candidates of every row of a
+        chunk of similarities.
+        Returns
+        -------
+        tuple
+            The rows, scores and gazette positions of the candidates.
+    """
+    rows, scores, positions = [], [], []
+    for row in range(similarities.shape[0]):
+        begin, end = similarities.indptr[row], similarities.indptr[row + 1]
+        row_scores = similarities.data[begin:end]
+        row_positions = similarities.indices[begin:end]
+
+        keep = row_scores > min_similarity
+        row_scores, row_positions = row_scores[keep], row_positions[keep]
+        if len(row_scores) > k:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            row_scores, row_positions = row_scores[top], row_positions[top]
+
+        rows.append(np.full(len(row_scores), row))
+        scores.append(row_scores)
+        positions.append(row_positions.astype(np.int64) + offset)
+
+    return np.concatenate(rows), np.concatenate(scores), np.concatenate(positions)
+
+
+def _merge(best, chunk, k):
+    """Internal method that merges the candidates of two chunks, keeping the
+        k best of every row.
+        Returns
+        -------
+        tuple
+            The rows, scores and gazette positions of the candidates, sorted
+            by row, then by decreasing score, then by position.
+    """
+    rows, scores, positions = (np.concatenate(pair) for pair in zip(best, chunk))
+    order = np.lexsort((positions, -scores, rows))
+    rows, scores, positions = rows[order], scores[order], positions[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    return rows[keep], scores[keep], positions[keep]
+
+
+def _text(value):
+    """Internal method that returns the string indexed for a value."""
+    return '' if value is None else str(value)
+
+
+def _candidate_blocks(index, clean_data, messy_data, n_candidates):
+    """Internal method that yields the pairs of every messy record with its
+        candidates, in the block format of Gazetteer.blocks.
+    """
+    messy_ids = list(messy_data)
+    values = [messy_data[messy_id][index.field] for messy_id in messy_ids]
+    for messy_id, candidates in zip(messy_ids, index.query(values, n_candidates)):
+        if candidates:
+            record = (messy_id, messy_data[messy_id])
+            yield [(record, (canon_id, clean_data[canon_id])) for canon_id in candidates]
+
+
+def search_candidates(deduper, index, clean_data, messy_data, threshold=0.0, n_matches=1, n_candidates=10):
+    """Matches messy records against the gazette like Gazetteer.search, but
+        compares every messy record with its candidates from an n-gram index
+        instead of the records it shares blocks with.
+        Parameters
+        ----------
+        deduper : dedupe.Gazetteer
+            A trained instance of gazetteer dedupe. The gazette does not need
+            to be indexed into it.
+        index : NgramIndex
+            The index of the gazette. Messy records are looked up by the
+            field it indexes.
+        clean_data : dict
+            The {gazette id: record} gazette records the index was built from.
+        messy_data : dict
+            The {messy id: record} records to match.
+        threshold : float, default 0.0
+            Only matches scoring above the threshold are returned.
+        n_matches : int, default 1
+            The number of best matches returned per messy record.
+        n_candidates : int, default 10
+            The number of candidates scored per messy record. More candidates
+            increase recall and the time spent scoring.
+        Returns
+        -------
+        generator
+            The (messy id, ((gazette id, confidence), ...)) matches of every
+            messy record, best first.
+    """
+    scored_blocks = deduper.score(_candidate_blocks(index, clean_data, messy_data, n_candidates))
+
+    seen = set()
+    for block in deduper.many_to_n(scored_blocks, threshold, n_matches):
+        matches = block.tolist()
+        messy_id = matches[0][0][0]
+        seen.add(messy_id)
+        yield messy_id, tuple((canon_id, score) for (_, canon_id), score in matches)
+
+    for messy_id in messy_data.keys() - seen:
+        yield messy_id, ()
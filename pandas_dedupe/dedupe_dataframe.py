@@ -1,19 +1,34 @@
 from pandas_dedupe.utility_functions import (
     clean_punctuation,
+    field_names,
     select_fields,
-    specify_type
+    specify_type,
+    stable_cluster_id
 )
+from pandas_dedupe.records import records_from_dataframe
+from pandas_dedupe.incremental import cluster_incremental
+from pandas_dedupe.sharding import partition_sharded
+from pandas_dedupe.instrumentation import NullStats
+from pandas_dedupe.blocking import block_sizes, size_histogram, cap_blocks
+from pandas_dedupe.blocking_cache import cached_blocking
 
 import os
 import logging
 import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 
 import dedupe
+import numpy as np
 import pandas as pd
 
 
 logging.getLogger().setLevel(logging.WARNING)
 
+# The number of clusters sent to a canonicalization worker at a time
+CANONICALIZE_BATCH = 1000
+
 
 def _active_learning(data, sample_size, deduper, training_file, settings_file):
     """Internal method that trains the deduper model using active learning.
@@ -123,7 +138,7 @@ def _train(settings_file, training_file, data, field_properties, sample_size, up
     return deduper
 
 
-def _cluster(deduper, data, threshold, canonicalize):
+def _cluster(deduper, data, threshold):
     """Internal method that clusters the data.
         Parameters
         ----------
@@ -133,13 +148,10 @@ def _cluster(deduper, data, threshold, canonicalize):
             The dedupe formatted data dictionary.
         threshold : dedupe.Threshold
             The threshold used for clustering.
-        canonicalize : bool or list, default False
-            Option that provides the canonical records as additional columns.
-            Specifying a list of column names only canonicalizes those columns.
         Returns
         -------
-        pd.DataFrame
-            A dataframe storing the clustering results.
+        list
+            The (record ids, confidence scores) clusters.
     """
     # ## Clustering
     print('Clustering...')
@@ -147,54 +159,279 @@ def _cluster(deduper, data, threshold, canonicalize):
 
     print('# duplicate sets', len(clustered_dupes))
 
-    # Convert data_d to string so that Price & LatLong won't get traceback
-    # during dedupe.canonicalize()
-    for i in data.values():
-        for key in i:
-            if i[key] is None:
-                pass
-            else:
-                i[key] = str(i[key])
-    
-    df_data = []
-    # ## Writing Results
-    cluster_id = 0
-    for (cluster_id, cluster) in enumerate(clustered_dupes):
-        id_set, scores = cluster
-        cluster_d = [data[c] for c in id_set]
+    return clustered_dupes
+
+
+def _exact_duplicates(df, fields):
+    """Internal method that finds the rows of df that are identical on the
+        given fields, comparing a 64 bit hash of their values.
+        Returns
+        -------
+        tuple
+            The index of the first row of every distinct set of values, and a
+            {first row id: [other row ids]} dictionary of the rows it stands
+            for.
+    """
+    keys = pd.util.hash_pandas_object(df[fields], index=False).to_numpy()
+    codes, uniques = pd.factorize(keys)
+
+    # Rows grouped by code, in their original order within every group
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1]])
+    groups = np.split(df.index.to_numpy()[order], starts[1:])
+
+    duplicates = {group[0]: group[1:].tolist() for group in groups if len(group) > 1}
+    representatives = df.index[np.sort(order[starts])]
+
+    return representatives, duplicates
+
+
+def _expand_duplicates(clustered_dupes, duplicates):
+    """Internal method that adds the rows collapsed by _exact_duplicates to the
+        clusters of their representative, with a confidence of 1.0.
+    """
+    expanded = []
+    for id_set, scores in clustered_dupes:
+        members = list(itertools.chain.from_iterable(duplicates.get(record_id, ()) for record_id in id_set))
+        if members:
+            id_set = tuple(id_set) + tuple(members)
+            scores = tuple(scores) + (1.0,) * len(members)
+        expanded.append((id_set, scores))
+    return expanded
+
+
+def _stringify(record, fields):
+    """Internal method that copies the given fields of a record as strings, so
+        that Price & LatLong won't get traceback during dedupe.canonicalize().
+        The record itself is left untouched.
+    """
+    return {key: None if record[key] is None else str(record[key]) for key in fields}
 
-        canonical_rep = None
-        if canonicalize:
-            canonical_rep = dedupe.canonicalize(cluster_d)
 
-        for record_id, score in zip(id_set, scores):
-            tmp = {
-                'Id': record_id,
-                'cluster id': cluster_id,
-                'confidence': score,
-            }
+def _canonicalize_batch(clusters):
+    """Internal method run by the workers. Canonicalizes a batch of clusters
+        of stringified records.
+    """
+    return [dedupe.canonicalize(cluster) for cluster in clusters]
 
-            if canonicalize:
-                fields_to_canon = canonical_rep.keys()
 
-                if isinstance(canonicalize, list):
-                    fields_to_canon = canonicalize
+def _canonical_records(data, clustered_dupes, cluster_ids, canonicalize, n_cores=None, executor=None):
+    """Internal method that computes the canonical record of every cluster.
+        Parameters
+        ----------
+        data : dict
+            The dedupe formatted data dictionary.
+        clustered_dupes : list
+            The (record ids, confidence scores) clusters.
+        cluster_ids : np.ndarray
+            The cluster id of every cluster.
+        canonicalize : bool or list
+            True to canonicalize every field, or a list of the fields to
+            canonicalize.
+        n_cores : int, default None
+            The number of processes that canonicalize clusters, in batches of
+            CANONICALIZE_BATCH. By default it is equal to the CPU count; 0 or
+            1 canonicalizes in the main process.
+        executor : concurrent.futures.Executor, default None
+            If provided, batches are canonicalized by this executor instead of
+            a new process pool.
+        Returns
+        -------
+        pd.DataFrame
+            One row of canonical_ columns per cluster, indexed by cluster id.
+    """
+    if isinstance(canonicalize, list):
+        fields = canonicalize
+    else:
+        fields = list(next(iter(data.values()), {}))
+
+    canonical_reps = [None] * len(clustered_dupes)
+    shared = []
+    for i, (id_set, _) in enumerate(clustered_dupes):
+        if len(id_set) == 1:
+            # A record is its own canonical form, with empty values as ''
+            # like dedupe.canonicalize
+            record = _stringify(data[id_set[0]], fields)
+            canonical_reps[i] = {key: value or '' for key, value in record.items()}
+        else:
+            shared.append(i)
+
+    batches = [shared[i:i + CANONICALIZE_BATCH] for i in range(0, len(shared), CANONICALIZE_BATCH)]
+
+    def members(batch):
+        return [[_stringify(data[c], fields) for c in clustered_dupes[i][0]] for i in batch]
+
+    n_workers = os.cpu_count() if n_cores is None else n_cores
+    if executor is not None and len(batches) > 1:
+        futures = [executor.submit(_canonicalize_batch, members(batch)) for batch in batches]
+        for batch, future in zip(batches, futures):
+            for i, rep in zip(batch, future.result()):
+                canonical_reps[i] = rep
+    elif n_workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(batches))) as executor:
+            results = executor.map(_canonicalize_batch, (members(batch) for batch in batches))
+            for batch, reps in zip(batches, results):
+                for i, rep in zip(batch, reps):
+                    canonical_reps[i] = rep
+    else:
+        for batch in batches:
+            for i, rep in zip(batch, _canonicalize_batch(members(batch))):
+                canonical_reps[i] = rep
 
-                for key in fields_to_canon:
-                    canon_key = 'canonical_' + key
-                    tmp[canon_key] = canonical_rep[key]
+    canonical_df = pd.DataFrame(canonical_reps, columns=fields,
+                                index=pd.Index(cluster_ids, name='cluster id'))
 
-            df_data.append(tmp)
+    return canonical_df.add_prefix('canonical_')
 
-    clustered_df = pd.DataFrame(df_data)
-    clustered_df = clustered_df.set_index('Id')
+
+def _cluster_results(data, clustered_dupes, canonicalize, n_cores=None, executor=None):
+    """Internal method that turns clusters into a results dataframe.
+        Parameters
+        ----------
+        data : dict
+            The dedupe formatted data dictionary.
+        clustered_dupes : list
+            The (record ids, confidence scores) clusters.
+        canonicalize : bool or list, default False
+            Option that provides the canonical records as additional columns.
+            Specifying a list of column names only canonicalizes those columns.
+        n_cores : int, default None
+            The number of processes used to canonicalize clusters.
+        executor : concurrent.futures.Executor, default None
+            The executor that canonicalizes clusters, instead of a new pool.
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe storing the clustering results.
+    """
+    # ## Writing Results
+    # One entry per cluster, expanded to one entry per record without
+    # building a Python object for every record
+    sizes = np.fromiter((len(id_set) for id_set, _ in clustered_dupes),
+                        dtype=np.int64, count=len(clustered_dupes))
+    cluster_ids = np.fromiter((stable_cluster_id(id_set) for id_set, _ in clustered_dupes),
+                              dtype=np.int64, count=len(clustered_dupes))
+    n_records = int(sizes.sum())
+
+    # A list, as pandas infers the dtype of an index from it, but not from an
+    # object array, and np.fromiter only builds object arrays on numpy>=1.23
+    record_ids = list(itertools.chain.from_iterable(id_set for id_set, _ in clustered_dupes))
+    confidences = np.fromiter(itertools.chain.from_iterable(scores for _, scores in clustered_dupes),
+                              dtype=np.float32, count=n_records)
+
+    clustered_df = pd.DataFrame({'cluster id': np.repeat(cluster_ids, sizes),
+                                 'confidence': confidences},
+                                index=pd.Index(record_ids, name='Id'))
+
+    # Canonical values are stored once per cluster and joined on cluster id
+    if canonicalize:
+        canonical_df = _canonical_records(data, clustered_dupes, cluster_ids, canonicalize, n_cores,
+                                          executor)
+        clustered_df = clustered_df.join(canonical_df, on='cluster id')
 
     return clustered_df
 
 
+def _prepare(df, field_properties, canonicalize, categorical, collapse_duplicates, stats):
+    """Internal method that cleans and types the dataframe and builds its
+        records.
+        Returns
+        -------
+        tuple
+            The cleaned dataframe, the records of every row, the records to
+            match and the {representative id: [row ids]} exact duplicates, or
+            None if collapse_duplicates is False.
+    """
+    # Records only carry the matching fields, plus the columns to canonicalize
+    fields = field_names(field_properties)
+    if canonicalize:
+        to_canon = canonicalize if isinstance(canonicalize, list) else df.columns
+        fields += [i for i in to_canon if i not in fields]
+
+    with stats.stage('clean_punctuation', records=len(df)):
+        if categorical:
+            df = clean_punctuation(df, fields, categorical=True)
+        else:
+            df = clean_punctuation(df)
+    
+    with stats.stage('specify_type'):
+        specify_type(df, field_properties)                
+    
+    with stats.stage('records'):
+        data_d = records_from_dataframe(df, fields)
+
+    # Exact duplicates are matched through a single representative
+    data_unique = data_d
+    duplicates = None
+    if collapse_duplicates:
+        with stats.stage('collapse_duplicates') as stage:
+            representatives, duplicates = _exact_duplicates(df, field_names(field_properties))
+            data_unique = {record_id: data_d[record_id] for record_id in representatives}
+            stage['records'] = len(data_unique)
+        print('# unique records', len(data_unique))
+
+    return df, data_d, data_unique, duplicates
+
+
+def _deduplicate(deduper, df, data_d, data_unique, duplicates, settings_file, threshold,
+                 canonicalize, n_cores, stats, incremental=False, state_file=None, n_shards=None,
+                 executor=None, max_block_size=None, oversized_blocks='split',
+                 canonicalize_executor=None, cache_file=None, fields=None):
+    """Internal method that clusters the records prepared by _prepare with a
+        trained deduper and joins the clusters to the dataframe.
+    """
+    with ExitStack() as stack:
+        if cache_file is not None:
+            stack.enter_context(cached_blocking(deduper, fields, settings_file, cache_file))
+        clustered_dupes = _block_and_cluster(deduper, data_d, data_unique, settings_file, threshold, stats,
+                                             incremental, state_file, n_shards, executor,
+                                             max_block_size, oversized_blocks)
+
+    if duplicates is not None:
+        clustered_dupes = _expand_duplicates(clustered_dupes, duplicates)
+
+    with stats.stage('results'):
+        clustered_df = _cluster_results(data_d, clustered_dupes, canonicalize, n_cores,
+                                        canonicalize_executor)
+        results = df.join(clustered_df, how='left')
+
+    return results
+
+
+def _block_and_cluster(deduper, data_d, data_unique, settings_file, threshold, stats, incremental,
+                       state_file, n_shards, executor, max_block_size, oversized_blocks):
+    """Internal method that blocks and clusters the records."""
+    sizes = {}
+    if stats.collect_block_sizes or max_block_size:
+        with stats.stage('block_sizes') as stage:
+            sizes = block_sizes(deduper, data_unique)
+            stats.block_sizes = size_histogram(sizes)
+            stage['blocks'] = len(sizes)
+
+    # Cluster the records
+    with stats.stage('cluster') as stage, stats.count_pairs(deduper, stage), \
+            cap_blocks(deduper, sizes, max_block_size, oversized_blocks):
+        if incremental:
+            print('Clustering...')
+            clustered_dupes = cluster_incremental(deduper, data_d, threshold,
+                                                  settings_file, state_file)
+        elif n_shards:
+            print('Clustering...')
+            clustered_dupes = partition_sharded(deduper, data_unique, threshold, settings_file,
+                                                n_shards, executor)
+            print('# duplicate sets', len(clustered_dupes))
+        else:
+            clustered_dupes = _cluster(deduper, data_unique, threshold)
+        stage['clusters'] = len(clustered_dupes)
+
+    return clustered_dupes
+
+
 def dedupe_dataframe(df, field_properties, canonicalize=False,
                      config_name="dedupe_dataframe", update_model=False, threshold=0.4,
-                     sample_size=0.3, n_cores=None):
+                     sample_size=0.3, n_cores=None, incremental=False, n_shards=None,
+                     executor=None, max_block_size=None, oversized_blocks='split',
+                     collapse_duplicates=False, categorical=False, cache_blocks=False, stats=None):
     """Deduplicates a dataframe given fields of interest.
         Parameters
         ----------
@@ -218,39 +455,99 @@ def dedupe_dataframe(df, field_properties, canonicalize=False,
             Specify the sample size used for training as a float from 0 to 1.
             By default it is 30% (0.3) of our data.
         n_cores : int, default None
-            Specify the number of cores to use during clustering.
+            Specify the number of cores to use during clustering and
+            canonicalization.
             By default n_cores is equal to None (i.e. use multipressing equal to CPU count).
+        incremental : bool, default False
+            If True, the cluster assignments and blocking map of each run are
+            stored in <config_name>_incremental.db, and later runs only block
+            and cluster records that are new or changed since, merging them
+            into the stored clusters.
+            The first run, and any run after the settings file changes, clusters
+            every record. Predicates that use an index of the data are
+            evaluated over every record on every run.
+        n_shards : int, default None
+            If provided, records are blocked once and split into n_shards
+            shards of records that share blocking keys. Each shard is scored
+            and clustered by its own worker with the blocking keys computed
+            up front, so results are the same as clustering all records at once.
+        executor : concurrent.futures.Executor, default None
+            The executor that runs the shards when n_shards is provided. Any
+            object with a concurrent.futures style submit method can be used.
+            By default a ProcessPoolExecutor with n_shards workers is used.
+        max_block_size : int, default None
+            If provided, blocks holding more records are logged with a warning
+            and handled as set by oversized_blocks before any pair is scored.
+            Use pandas_dedupe.blocking.analyze_blocking to choose a value.
+        oversized_blocks : str, default 'split'
+            'split' compares the records of an oversized block in consecutive
+            parts of max_block_size records, 'skip' does not compare them.
+            Records that only share an oversized block may then be missed.
+        collapse_duplicates : bool, default False
+            If True, rows that are identical on every field of field_properties
+            after cleaning are matched once. The other rows are added to the
+            cluster of the first one with a confidence of 1.0.
+        categorical : bool, default False
+            If True, only the fields of field_properties and the columns to
+            canonicalize are cleaned, and they are kept as categoricals so that
+            every distinct value is stored once. The other columns are returned
+            as they are in df.
+        cache_blocks : bool, default False
+            If True, the blocking keys of every record are cached in
+            <config_name>_blocking_keys.npz, keyed by a hash of the record's
+            cleaned field values and of the settings file. Later runs only
+            evaluate the blocking predicates on new or changed records, except
+            for predicates with any index part, including compound predicates
+            that combine an index predicate with a simple one, which are
+            evaluated on every run. Cannot be combined with incremental, whose
+            state already stores the blocking keys of earlier records.
+        stats : PipelineStats, default None
+            If provided, the wall time, CPU time, peak memory and record and
+            pair counts of every stage are recorded in it.
     
         Returns
         -------
         pd.DataFrame
             A pandas dataframe that contains the cluster id and confidence
             score. Optionally, it will contain canonicalized columns for all
-            attributes of the record.
+            attributes of the record. Cluster ids are derived from the
+            smallest member index, so they are stable across runs.
     """
+    if incremental and n_shards:
+        raise ValueError('incremental and n_shards cannot be combined')
+    if max_block_size and (incremental or n_shards):
+        raise ValueError('max_block_size cannot be combined with incremental or n_shards')
+    if incremental and collapse_duplicates:
+        raise ValueError('incremental and collapse_duplicates cannot be combined')
+    if incremental and cache_blocks:
+        raise ValueError('incremental and cache_blocks cannot be combined')
+    if oversized_blocks not in ('split', 'skip'):
+        raise ValueError("oversized_blocks must be 'split' or 'skip'")
+
     # Import Data  
     config_name = config_name.replace(" ", "_")
    
     settings_file = config_name + '_learned_settings'
     training_file = config_name + '_training.json'
+    state_file = config_name + '_incremental.db'
+    cache_file = config_name + '_blocking_keys.npz' if cache_blocks else None
 
-    print('Importing data ...')
+    if stats is None:
+        stats = NullStats()
 
-    df = clean_punctuation(df)
-    
-    specify_type(df, field_properties)                
-    
-    df['dictionary'] = df.apply(
-        lambda x: dict(zip(df.columns, x.tolist())), axis=1)
-    data_d = dict(zip(df.index, df.dictionary))
+    print('Importing data ...')
+    df, data_d, data_unique, duplicates = _prepare(df, field_properties, canonicalize, categorical,
+                                                   collapse_duplicates, stats)
 
     # Train or load the model
-    deduper = _train(settings_file, training_file, data_d, field_properties,
-                     sample_size, update_model, n_cores)
-
-    # Cluster the records
-    clustered_df = _cluster(deduper, data_d, threshold, canonicalize)
-    results = df.join(clustered_df, how='left')
-    results.drop(['dictionary'], axis=1, inplace=True)
+    with stats.stage('train'):
+        deduper = _train(settings_file, training_file, data_unique, field_properties,
+                         sample_size, update_model, n_cores)
+
+    results = _deduplicate(deduper, df, data_d, data_unique, duplicates, settings_file, threshold,
+                           canonicalize, n_cores, stats, incremental=incremental, state_file=state_file,
+                           n_shards=n_shards, executor=executor, max_block_size=max_block_size,
+                           oversized_blocks=oversized_blocks, cache_file=cache_file,
+                           fields=field_names(field_properties))
 
     return results
@@ -0,0 +1,271 @@
+import os
+import pickle
+import logging
+import sqlite3
+import itertools
+
+import numpy as np
+
+from pandas_dedupe.utility_functions import record_digest, settings_digest, static_predicates
+
+
+# Bumped whenever the persisted index changes meaning, so older ones are rebuilt
+INDEX_FORMAT = 2
+
+
+def _gazette_digest(clean_data):
+    """Internal method that digests the cleaned gazette as the sum of the
+        digests of its records, so that it does not depend on their order.
+    """
+    return sum(int.from_bytes(record_digest((record_id, record)), 'big')
+               for record_id, record in clean_data.items()) % (1 << 128)
+
+
+def _index_key(clean_data, settings_file):
+    """Internal method that identifies the cleaned gazette and the settings
+        file a persisted index was built from.
+        Parameters
+        ----------
+        clean_data : dict
+            The dictionary form of the gazette that gazetteer_dedupe requires.
+        settings_file : str
+            A path to the settings file used by the gazetteer.
+        Returns
+        -------
+        dict
+            The digests of both, which change whenever either input changes.
+    """
+    return {'format': INDEX_FORMAT,
+            'settings': settings_digest(settings_file),
+            'gazette': _gazette_digest(clean_data)}
+
+
+def _predicates(deduper, index):
+    """Internal method that returns the predicates that use an index of the
+        gazette if index is True, or those that do not otherwise, with the
+        ':<position>' suffix of their block keys.
+    """
+    static = set(static_predicates(deduper.fingerprinter))
+    return [(':' + str(i), predicate) for i, predicate in enumerate(deduper.fingerprinter.predicates)
+            if (i not in static) == index]
+
+
+def _block_keys(records, predicates):
+    """Internal method that yields the (block key, record id) pairs of the
+        gazette records for the given predicates.
+    """
+    for record_id, record in records.items():
+        for suffix, predicate in predicates:
+            for block_key in predicate(record, target=True):
+                yield block_key + suffix, record_id
+
+
+def _copy_database(source, target):
+    """Internal method that copies an sqlite database with the backup API."""
+    source_con = sqlite3.connect(source)
+    target_con = sqlite3.connect(target)
+    try:
+        source_con.backup(target_con)
+    finally:
+        source_con.close()
+        target_con.close()
+
+
+def _load_index(deduper, clean_data, key, index_file):
+    """Internal method that restores a persisted gazette index into deduper.
+
+        The blocking map only holds the keys of the predicates that use no
+        index. The predicate indices live in memory, in part outside Python,
+        so they are built again from the gazette, and the keys of the
+        predicates that use them are computed again.
+        Returns
+        -------
+        bool
+            True if a matching index was found and loaded.
+    """
+    state_path = index_file + '.pkl'
+    db_path = index_file + '.db'
+    if not (os.path.exists(state_path) and os.path.exists(db_path)):
+        return False
+
+    try:
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('key') != key:
+            return False
+        _copy_database(db_path, deduper.db)
+    except Exception:
+        logging.warning('Could not read the gazette index in %s, rebuilding it', index_file)
+        return False
+
+    predicates = _predicates(deduper, index=True)
+    if predicates:
+        deduper.fingerprinter.index_all(clean_data)
+        con = sqlite3.connect(deduper.db)
+        con.executemany("REPLACE INTO indexed_records VALUES (?, ?)", _block_keys(clean_data, predicates))
+        con.commit()
+        con.close()
+
+    deduper.indexed_data.update(clean_data)
+    return True
+
+
+def _save_index(deduper, key, index_file):
+    """Internal method that persists the blocking map of deduper, without the
+        keys of the predicates that use an index, as those are only valid
+        with the index they were computed with.
+    """
+    state_path = index_file + '.pkl'
+    db_path = index_file + '.db'
+
+    # Drop the old state first, so a partially written index is never loaded
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+    _copy_database(deduper.db, db_path + '.tmp')
+    con = sqlite3.connect(db_path + '.tmp')
+    con.executemany("DELETE FROM indexed_records WHERE substr(block_key, ?) = ?",
+                    ((-len(suffix), suffix) for suffix, _ in _predicates(deduper, index=True)))
+    # Lets update_gazette drop the keys of a record without a full scan
+    con.execute("CREATE INDEX IF NOT EXISTS indexed_records_record_id_idx ON indexed_records (record_id)")
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+    os.replace(db_path + '.tmp', db_path)
+
+    with open(state_path + '.tmp', 'wb') as f:
+        pickle.dump({'key': key}, f, protocol=4)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def index_gazette(deduper, clean_data, settings_file, index_file):
+    """Indexes the gazette, reusing the index persisted at index_file when it
+        was built from the same cleaned gazette and settings file.
+
+        Only the blocking keys of predicates that use no index of the gazette
+        are reused. Index predicates, such as search predicates, index the
+        gazette again on every load.
+        Parameters
+        ----------
+        deduper : dedupe.Gazetteer
+            A trained instance of gazetteer dedupe.
+        clean_data : dict
+            The dictionary form of the gazette that gazetteer_dedupe requires.
+        settings_file : str
+            A path to the settings file used by the gazetteer.
+        index_file : str
+            The path prefix of the persisted index. The blocking map is stored
+            in index_file.db and the digests it was built from in
+            index_file.pkl.
+    """
+    key = _index_key(clean_data, settings_file)
+
+    if _load_index(deduper, clean_data, key, index_file):
+        print('Reading gazette index from', index_file)
+        return
+
+    deduper.index(clean_data)
+    _save_index(deduper, key, index_file)
+
+
+def _reindex_shared_values(deduper, stale):
+    """Internal method that puts back into the predicate indices the values of
+        unindexed records that other indexed records still hold, as unindex
+        removes values from them regardless of how many records hold them.
+
+        A value indexed again gets a new document id, so the index predicate
+        keys of the records that hold it are computed again and replace the
+        keys holding the old id.
+    """
+    holders = {}
+    for field in deduper.fingerprinter.index_fields:
+        values = {record[field] for record in stale.values() if record[field]}
+        shared = values & {record[field] for record in deduper.indexed_data.values()}
+        if shared:
+            deduper.fingerprinter.index(shared, field)
+            holders.update((record_id, record) for record_id, record in deduper.indexed_data.items()
+                           if record[field] in shared)
+
+    if not holders:
+        return
+
+    predicates = _predicates(deduper, index=True)
+    con = sqlite3.connect(deduper.db)
+    con.executemany("DELETE FROM indexed_records WHERE record_id = ? AND substr(block_key, ?) = ?",
+                    ((record_id, -len(suffix), suffix) for record_id in holders for suffix, _ in predicates))
+    con.executemany("REPLACE INTO indexed_records VALUES (?, ?)", _block_keys(holders, predicates))
+    con.commit()
+    con.close()
+
+
+def _update_index(deduper, stale, added, index_file):
+    """Internal method that applies a gazette update to the index persisted
+        at index_file. Only the block keys of the changed records are written,
+        and the gazette digest is updated from their digests alone.
+    """
+    state_path = index_file + '.pkl'
+    db_path = index_file + '.db'
+    try:
+        with open(state_path, 'rb') as f:
+            key = pickle.load(f)['key']
+    except Exception:
+        logging.warning('Could not read the gazette index in %s, it is not updated', index_file)
+        return
+
+    key = dict(key, gazette=(key['gazette'] - _gazette_digest(stale) + _gazette_digest(added)) % (1 << 128))
+
+    # Drop the state first, so a partially updated index is never loaded
+    os.remove(state_path)
+
+    con = sqlite3.connect(db_path)
+    con.executemany("DELETE FROM indexed_records WHERE record_id = ?", ((record_id,) for record_id in stale))
+    con.executemany("REPLACE INTO indexed_records VALUES (?, ?)",
+                    _block_keys(added, _predicates(deduper, index=False)))
+    con.commit()
+    con.close()
+
+    with open(state_path + '.tmp', 'wb') as f:
+        pickle.dump({'key': key}, f, protocol=4)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def update_gazette(deduper, added=None, removed=None, index_file=None):
+    """Adds records to, and removes records from, the indexed gazette of
+        deduper. Only the changed records are blocked, and searches reflect
+        the changes as soon as this returns.
+        Parameters
+        ----------
+        deduper : dedupe.Gazetteer
+            A trained instance of gazetteer dedupe, with the gazette indexed.
+        added : dict, default None
+            The {gazette id: record} cleaned records to add. Records with the
+            id of an indexed record replace it.
+        removed : iterable, default None
+            The ids of the gazette records to remove.
+        index_file : str, default None
+            If provided, the change is also applied to the index persisted at
+            this path prefix by index_gazette, writing only the block keys of
+            the changed records. Later runs on the updated gazette then load
+            it instead of rebuilding it.
+    """
+    added = added or {}
+    # The blocking map does not match numpy ids, such as the cluster ids of search results
+    removed = [record_id.item() if isinstance(record_id, np.generic) else record_id
+               for record_id in removed or ()]
+
+    missing = [record_id for record_id in removed if record_id not in deduper.indexed_data]
+    if missing:
+        raise KeyError('Not in the gazette index: ' + ', '.join(map(str, missing[:10])))
+
+    # Replaced records are unindexed first, so that their old block keys are dropped
+    stale = {record_id: deduper.indexed_data[record_id]
+             for record_id in itertools.chain(removed, added) if record_id in deduper.indexed_data}
+    if stale:
+        deduper.unindex(stale)
+        _reindex_shared_values(deduper, stale)
+
+    if added:
+        deduper.index(added)
+
+    if index_file is not None:
+        _update_index(deduper, stale, added, index_file)
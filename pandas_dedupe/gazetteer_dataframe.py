@@ -3,13 +3,19 @@ from pandas_dedupe.utility_functions import (
     select_fields,
     specify_type
 )
+from pandas_dedupe.records import records_from_dataframe
+from pandas_dedupe.gazette_index import index_gazette
+from pandas_dedupe.candidates import NgramIndex, search_candidates
+from pandas_dedupe.instrumentation import NullStats
 
 import os
 import io
+import itertools
 import logging
 import math
 
 import dedupe
+import numpy as np
 import pandas as pd
 
 
@@ -130,7 +136,92 @@ def _train(settings_file, training_file, clean_data, messy_data, field_propertie
     return deduper
 
 
-def _cluster(deduper, clean_data, messy_data, threshold, canonicalize):
+def _match_results(clustered_dupes, canonical_df=None, n_matches=1):
+    """Internal method that keeps the best gazette matches of every messy record.
+        Parameters
+        ----------
+        clustered_dupes : iterable
+            The (messy id, matches) pairs returned by Gazetteer.search, with
+            the matches of every record sorted by decreasing confidence.
+        canonical_df : pd.DataFrame, default None
+            The gazette columns, prefixed with 'canonical_' and indexed by
+            gazette id, to add to each match. If None, none are added.
+        n_matches : int, default 1
+            The number of best matches kept per messy record.
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe storing the clustering results, indexed by messy id.
+    """
+    # ## Writing Results
+    # Matches are consumed as search yields them, keeping the best n_matches
+    # of every record, which come first
+    record_ids = []
+    cluster_ids = []
+    confidences = []
+    for messy_id, matches in clustered_dupes:
+        for canon_id, score in matches[:n_matches]:
+            record_ids.append(messy_id)
+            cluster_ids.append(canon_id)
+            confidences.append(score)
+
+    clustered_df = pd.DataFrame({'cluster id': cluster_ids,
+                                 'confidence': np.array(confidences, dtype=np.float32)},
+                                index=pd.Index(record_ids, name='record id'))
+
+    # Add canonical name, looked up by position in the gazette
+    if canonical_df is not None:
+        positions = canonical_df.index.get_indexer(clustered_df['cluster id'])
+        canonical = canonical_df.take(positions)
+        canonical.index = clustered_df.index
+        clustered_df = pd.concat([clustered_df, canonical], axis=1)
+
+    return clustered_df
+
+
+def _index(deduper, clean_data, settings_file, index_file, candidates=None, n_candidates=10):
+    """Internal method that indexes the gazette. If index_file is provided,
+        the index is persisted there and reused while the gazette and the
+        settings file are unchanged.
+
+        If candidates is 'ngram' or an NgramIndex, the gazette is not blocked.
+        Candidates are instead looked up in an n-gram index of its only field,
+        built here for 'ngram'.
+        Returns
+        -------
+        tuple
+            The (NgramIndex, gazette records, n_candidates) to search with, or
+            None to search the blocked gazette.
+    """
+    if candidates is not None:
+        if isinstance(candidates, str):
+            if candidates != 'ngram':
+                raise ValueError("candidates must be 'ngram' or an NgramIndex")
+            field, = next(iter(clean_data.values())).keys()
+            candidates = NgramIndex().fit(clean_data, field)
+        return candidates, clean_data, n_candidates
+
+    if index_file is None:
+        deduper.index(clean_data)
+    else:
+        index_gazette(deduper, clean_data, settings_file, index_file)
+    return None
+
+
+def _find_matches(deduper, messy_data, threshold, n_matches, candidates=None):
+    """Internal method that searches the gazette for the messy records, from
+        the candidates returned by _index if any.
+    """
+    if candidates is None:
+        return deduper.search(messy_data, threshold, n_matches=n_matches, generator=True)
+
+    index, clean_data, n_candidates = candidates
+    return search_candidates(deduper, index, clean_data, messy_data, threshold, n_matches, n_candidates)
+
+
+def _cluster(deduper, clean_data, messy_data, threshold, canonical_df=None,
+             settings_file=None, index_file=None, stats=None, n_matches=1,
+             candidates=None, n_candidates=10):
     """Internal method that clusters the data.
         Parameters
         ----------
@@ -143,67 +234,155 @@ def _cluster(deduper, clean_data, messy_data, threshold, canonicalize):
             (and canonicalized)
         threshold : dedupe.Threshold
             The threshold used for clustering.
-        canonicalize : bool or list, default False
-            Option that provides the canonical records as additional columns.
-            Specifying a list of column names only canonicalizes those columns.
+        canonical_df : pd.DataFrame, default None
+            The cleaned gazette, prefixed with 'canonical_', to add to each
+            match. If None, none are added.
+        settings_file : str, default None
+            A path to the settings file, used to key the persisted index.
+        index_file : str, default None
+            The path prefix of the persisted gazette index. If None, the
+            gazette is indexed from scratch.
+        stats : PipelineStats, default None
+            Records the index and search stages.
+        n_matches : int, default 1
+            The number of best matches kept per messy record.
+        candidates : str or NgramIndex, default None
+            If provided, candidates are looked up in an n-gram index instead of
+            the learned blocks, see _index.
+        n_candidates : int, default 10
+            The number of candidates scored per messy record.
         Returns
         -------
         pd.DataFrame
             A dataframe storing the clustering results.
     """
+    if stats is None:
+        stats = NullStats()
+
     # ## Clustering
     print('Clustering...')
-    deduper.index(clean_data)                       
-    
-    clustered_dupes = deduper.search(messy_data, threshold, n_matches=None, generator=False)
-    print('# duplicate sets', len(clustered_dupes))
-
-    # Convert data_d to string so that Price & LatLong won't get traceback
-    # during dedupe.canonicalize()
-    for i in messy_data.values():
-        for key in i:
-            if i[key] is None:
-                pass
-            else:
-                i[key] = str(i[key])
+    with stats.stage('index', records=len(clean_data)):
+        candidates = _index(deduper, clean_data, settings_file, index_file, candidates, n_candidates)
     
-    df_data = []
-    # ## Writing Results    
-    for _, (messy_id, matches) in enumerate(clustered_dupes):
-        for canon_id, scores in matches:
-            
-            tmp = {
-                'cluster id': canon_id,
-                'confidence': scores, 
-                'record id': messy_id
-            }
-            df_data.append(tmp)
+    with stats.stage('search', records=len(messy_data)) as stage, stats.count_pairs(deduper, stage):
+        clustered_dupes = _find_matches(deduper, messy_data, threshold, n_matches, candidates)
+        clustered_df = _match_results(clustered_dupes, canonical_df, n_matches)
+    print('# duplicate sets', len(clustered_df.index.unique()))
+
+    return clustered_df
+
+
+def _prepare_gazette(clean_data, field_properties):
+    """Internal method that validates and cleans the gazette.
+        Returns
+        -------
+        tuple
+            The name of the gazette column and the cleaned gazette dataframe.
+    """
+    assert type(clean_data)==pd.core.frame.DataFrame, 'Please provide a gazette in pandas dataframe format'
+    assert len(clean_data.columns)==1, 'Please provide a gazetteer dataframe made of a single variable'
+    assert type(field_properties) == str, 'field_properties must be in string (str) format'
+
+    # Common column name
+    common_name = clean_data.columns[0]
     
-    # Add canonical name
-    if canonicalize:
-        clean_data_dict = pd.DataFrame.from_dict(clean_data).T.add_prefix('canonical_')
-        clustered_df = (pd.DataFrame.from_dict(df_data)        # Create cluster result dataframe
-                        .set_index('cluster id', drop=False)   # Note: cluster id is the index of clean_data (i.e. gazette)
-                        .join(clean_data_dict, how='left')     # join clustered results and gazette
-                        .set_index('record id')                # Note: record id is the index of the messy_data
-                       )
+    # Canonical dataset (i.e. gazette)
+    df_canonical = clean_punctuation(clean_data)
+    df_canonical.rename(columns={field_properties: common_name}, inplace=True)
+    specify_type(df_canonical, [common_name])                
+
+    return common_name, df_canonical
+
+
+def _prepare_messy(messy_data, field_properties, common_name):
+    """Internal method that cleans the messy data and returns its records,
+        keyed by the messy dataframe index.
+    """
+    df_messy = clean_punctuation(messy_data[[field_properties]])
+    df_messy.rename(columns={field_properties: common_name}, inplace=True)
+    specify_type(df_messy, [common_name])                
+
+    return records_from_dataframe(df_messy, [common_name], lazy=True)
+
+
+def _read_chunks(messy_data, chunksize):
+    """Internal method that yields the messy data as dataframe chunks.
+        messy_data can be a dataframe, an iterable of dataframes, or the path
+        to a CSV or Parquet file.
+    """
+    if isinstance(messy_data, pd.DataFrame):
+        for start in range(0, len(messy_data), chunksize):
+            yield messy_data.iloc[start:start + chunksize]
+
+    elif isinstance(messy_data, (str, os.PathLike)):
+        path = os.fspath(messy_data)
+        if path.endswith('.parquet'):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError('Reading Parquet files in chunks requires pyarrow')
+            offset = 0
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+                chunk = batch.to_pandas()
+                # Number rows across batches, like read_csv does across chunks
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+        else:
+            yield from pd.read_csv(path, chunksize=chunksize)
+
     else:
-        clustered_df = (pd.DataFrame.from_dict(df_data)        # Create clustered results dataframe
-                        .set_index('record id')                # Note: record id is the index of messy_data
-                       )
-                        
-    # Drop duplicates (i.e. keep canonical name with max confidence)
-    # Note: the reason for this is that gazetteer dedupe might assign the same obs to multiple clusters
-    confidence_maxes = clustered_df.groupby([clustered_df.index])['confidence'].transform(max) # Calculate max confidence
-    clustered_df = clustered_df.loc[clustered_df['confidence'] == confidence_maxes]   # Keep rows with max confidence 
-    clustered_df = clustered_df.loc[~clustered_df.index.duplicated(keep='first')]     # If same confidence keep the first obs
-                   
-    return clustered_df
+        yield from messy_data
+
+
+def _search_chunks(deduper, chunks, field_properties, common_name, threshold, canonical_df, stats,
+                   n_matches=1, candidates=None):
+    """Internal method that matches each messy chunk against the indexed
+        gazette and yields the joined results chunk by chunk.
+    """
+    for chunk_number, chunk in enumerate(chunks):
+        if chunk.empty:
+            continue
+
+        with stats.stage('search', chunk=chunk_number, records=len(chunk)) as stage, \
+                stats.count_pairs(deduper, stage):
+            results = _search(deduper, chunk, field_properties, common_name, threshold, canonical_df,
+                              n_matches, candidates)
+        yield results
+
+
+def _search(deduper, messy_data, field_properties, common_name, threshold, canonical_df, n_matches=1,
+            candidates=None):
+    """Internal method that matches a messy dataframe against the indexed
+        gazette and joins the best n_matches matches of every row to it.
+    """
+    messy = _prepare_messy(messy_data, field_properties, common_name)
+    clustered_dupes = _find_matches(deduper, messy, threshold, n_matches, candidates)
+    clustered_df = _match_results(clustered_dupes, canonical_df, n_matches)
+
+    results = messy_data.join(clustered_df, how='left')
+    results.rename(columns={'canonical_'+str(common_name): 'canonical_'+str(field_properties)}, inplace=True)
+    return results
+
+
+def _write_chunks(results, output):
+    """Internal method that appends result chunks to a CSV file.
+        Returns
+        -------
+        int
+            The number of rows written.
+    """
+    n_rows = 0
+    for i, chunk in enumerate(results):
+        chunk.to_csv(output, mode='w' if i == 0 else 'a', header=(i == 0))
+        n_rows += len(chunk)
+    return n_rows
 
 
 def gazetteer_dataframe(clean_data, messy_data, field_properties, canonicalize=False,
                      config_name="gazetteer_dataframe", update_model=False, threshold=0.3,
-                     sample_size=1, n_cores=None):
+                     sample_size=1, n_cores=None, cache_index=False, n_matches=1, candidates=None,
+                     n_candidates=10, stats=None):
     """Deduplicates a dataframe given fields of interest.
         Parameters
         ----------
@@ -233,6 +412,28 @@ def gazetteer_dataframe(clean_data, messy_data, field_properties, canonicalize=F
         n_cores : int, default None
             Specify the number of cores to use during clustering.
             By default n_cores is equal to None (i.e. use multipressing equal to CPU count).
+        cache_index : bool, default False
+            If True, the gazette index is saved next to the settings file (with
+            the prefix <config_name>_gazette_index) and loaded on later runs,
+            as long as the cleaned gazette and the settings file are unchanged.
+            Predicates that use an index of the gazette index it again on
+            every run.
+        n_matches : int, default 1
+            The number of best gazette matches kept per messy record. With more
+            than one, every match is a row, best first.
+        candidates : str or NgramIndex, default None
+            If 'ngram', the gazette is not blocked with the learned predicates.
+            Instead, every messy record is compared with the n_candidates
+            gazette records most similar to it, found in a character n-gram
+            TF-IDF index. A prebuilt pandas_dedupe.candidates.NgramIndex of the
+            cleaned gazette can be passed instead, for example one tuned for
+            recall or latency and loaded with NgramIndex.load.
+        n_candidates : int, default 10
+            The number of candidates scored per messy record when candidates
+            is provided.
+        stats : PipelineStats, default None
+            If provided, the wall time, CPU time, peak memory and record and
+            pair counts of every stage are recorded in it.
         Returns
         -------
         pd.DataFrame
@@ -245,40 +446,142 @@ def gazetteer_dataframe(clean_data, messy_data, field_properties, canonicalize=F
 
     settings_file = config_name + '_learned_settings'
     training_file = config_name + '_training.json'
+    index_file = config_name + '_gazette_index' if cache_index else None
 
-    print('Importing data ...')
-    assert type(clean_data)==pd.core.frame.DataFrame, 'Please provide a gazette in pandas dataframe format'
-    assert len(clean_data.columns)==1, 'Please provide a gazetteer dataframe made of a single variable'
-    assert type(field_properties) == str, 'field_properties must be in string (str) format'
+    if stats is None:
+        stats = NullStats()
 
-    # Common column name
-    common_name = clean_data.columns[0]
-    
-    # Canonical dataset (i.e. gazette)
-    df_canonical = clean_punctuation(clean_data)
-    df_canonical.rename(columns={field_properties: common_name}, inplace=True)
-    specify_type(df_canonical, [common_name])                
-    
-    df_canonical['dictionary'] = df_canonical.apply(
-        lambda x: dict(zip(df_canonical.columns, x.tolist())), axis=1)
-    canonical = dict(zip(df_canonical.index, df_canonical.dictionary))
+    print('Importing data ...')
+    with stats.stage('prepare_gazette', records=len(clean_data)):
+        common_name, df_canonical = _prepare_gazette(clean_data, field_properties)
+        canonical = records_from_dataframe(df_canonical, [common_name], lazy=True)
     
     # Messy dataset
-    df_messy = clean_punctuation(messy_data)
-    df_messy.rename(columns={field_properties: common_name}, inplace=True)
-    specify_type(df_messy, [common_name])                
-
-    df_messy['dictionary'] = df_messy.apply(
-        lambda x: dict(zip(df_messy.columns, x.tolist())), axis=1)
-    messy = dict(zip(df_messy.index, df_messy.dictionary))
+    with stats.stage('prepare_messy', records=len(messy_data)):
+        messy = _prepare_messy(messy_data, field_properties, common_name)
     
     # Train or load the model
-    deduper = _train(settings_file, training_file, canonical, messy, common_name,
-                     sample_size, update_model, n_cores)
+    with stats.stage('train'):
+        deduper = _train(settings_file, training_file, canonical, messy, common_name,
+                         sample_size, update_model, n_cores)
     
     # Cluster the records
-    clustered_df = _cluster(deduper, canonical, messy, threshold, canonicalize)
-    results = messy_data.join(clustered_df, how='left')
-    results.rename(columns={'canonical_'+str(common_name): 'canonical_'+str(field_properties)}, inplace=True)
+    canonical_df = None
+    if canonicalize:
+        canonical_df = df_canonical.add_prefix('canonical_')
+
+    clustered_df = _cluster(deduper, canonical, messy, threshold, canonical_df,
+                            settings_file, index_file, stats, n_matches, candidates, n_candidates)
+    with stats.stage('join'):
+        results = messy_data.join(clustered_df, how='left')
+        results.rename(columns={'canonical_'+str(common_name): 'canonical_'+str(field_properties)}, inplace=True)
 
     return results
+
+
+
+def gazetteer_dataframe_chunks(clean_data, messy_data, field_properties, canonicalize=False,
+                               config_name="gazetteer_dataframe", update_model=False, threshold=0.3,
+                               sample_size=1, n_cores=None, chunksize=100000, output=None,
+                               cache_index=False, n_matches=1, candidates=None, n_candidates=10,
+                               stats=None):
+    """Matches messy data that does not fit in memory against a gazette, one
+        chunk at a time. The gazette is indexed once and every chunk is
+        searched against it, so memory is bounded by the chunk size plus the
+        gazette index.
+        Parameters
+        ----------
+        clean_data : pd.DataFrame
+            The gazetteer dataframe.
+        messy_data : iterable of pd.DataFrame, pd.DataFrame or str
+            The data to match. Either an iterable of dataframe chunks (such as
+            the reader returned by pd.read_csv(..., chunksize=...)), a single
+            dataframe, or the path to a CSV or Parquet file. Reading Parquet
+            files requires pyarrow.
+        field_properties : str
+            A string specifying what fields to use for deduplicating records.
+        canonicalize : bool or list, default False
+            Option that provides the canonical records as additional columns.
+        config_name : str, default gazetteer_dataframe
+            The configuration file name. Note that this will be used as
+            a prefix to save the settings and training files.
+        update_model : bool, default False
+            If True, it allows user to update existing model by uploading
+            training file.
+        threshold : float, default 0.3
+           only consider put together records into clusters if the cophenetic similarity of the cluster 
+           is greater than the threshold.
+        sample_size : float, default 1
+            Specify the sample size used for training as a float from 0 to 1.
+            If the model needs training, it is trained on the first chunk.
+        n_cores : int, default None
+            Specify the number of cores to use during clustering.
+            By default n_cores is equal to None (i.e. use multipressing equal to CPU count).
+        chunksize : int, default 100000
+            The number of messy rows per chunk when messy_data is a dataframe
+            or a file path.
+        output : str, default None
+            A path to a CSV file. If provided, results are appended to it chunk
+            by chunk instead of being yielded.
+        cache_index : bool, default False
+            If True, the gazette index is persisted and reused across runs, as
+            in gazetteer_dataframe.
+        n_matches : int, default 1
+            The number of best gazette matches kept per messy record.
+        candidates : str or NgramIndex, default None
+            If provided, candidates are looked up in an n-gram index instead of
+            the learned blocks, as in gazetteer_dataframe.
+        n_candidates : int, default 10
+            The number of candidates scored per messy record.
+        stats : PipelineStats, default None
+            If provided, every stage is recorded in it, with one search stage
+            per chunk.
+        Returns
+        -------
+        generator of pd.DataFrame or int
+            A generator of result chunks, each holding the messy rows with their
+            cluster id and confidence score. If output is provided, the number
+            of rows written instead.
+    """
+    # Import Data  
+    config_name = config_name.replace(" ", "_")
+
+    settings_file = config_name + '_learned_settings'
+    training_file = config_name + '_training.json'
+    index_file = config_name + '_gazette_index' if cache_index else None
+
+    if stats is None:
+        stats = NullStats()
+
+    print('Importing data ...')
+    with stats.stage('prepare_gazette', records=len(clean_data)):
+        common_name, df_canonical = _prepare_gazette(clean_data, field_properties)
+        canonical = records_from_dataframe(df_canonical, [common_name], lazy=True)
+
+    # The first chunk doubles as the training sample if the model needs training
+    chunks = _read_chunks(messy_data, chunksize)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        raise ValueError('messy_data does not contain any rows')
+    chunks = itertools.chain([first_chunk], chunks)
+
+    # Train or load the model
+    with stats.stage('train'):
+        deduper = _train(settings_file, training_file, canonical,
+                         _prepare_messy(first_chunk, field_properties, common_name), common_name,
+                         sample_size, update_model, n_cores)
+
+    # Index the gazette once for all chunks
+    print('Clustering...')
+    with stats.stage('index', records=len(canonical)):
+        candidates = _index(deduper, canonical, settings_file, index_file, candidates, n_candidates)
+
+    canonical_df = None
+    if canonicalize:
+        canonical_df = df_canonical.add_prefix('canonical_')
+
+    results = _search_chunks(deduper, chunks, field_properties, common_name, threshold, canonical_df, stats,
+                             n_matches, candidates)
+    if output is None:
+        return results
+    return _write_chunks(results, output)
@@ -0,0 +1,240 @@
+import itertools
+import sqlite3
+
+import numpy as np
+
+from pandas_dedupe.utility_functions import cleanup_scores, record_digest, settings_digest, static_predicates
+
+
+# Bumped whenever the stored state changes meaning, so older state is rebuilt
+STATE_FORMAT = 2
+
+
+def _connect(state_file, settings_hash):
+    """Internal method that opens the incremental state database. The stored
+        state is discarded if it was produced with other settings, or by an
+        older version of this module.
+    """
+    con = sqlite3.connect(state_file)
+    con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    stored = dict(con.execute("SELECT key, value FROM meta"))
+    if stored.get('settings_hash') != settings_hash or stored.get('format') != STATE_FORMAT:
+        con.executescript("""DROP TABLE IF EXISTS records;
+                             DROP TABLE IF EXISTS blocking_map;
+                             DELETE FROM meta;""")
+        con.execute("INSERT INTO meta VALUES ('settings_hash', ?)", (settings_hash,))
+        con.execute("INSERT INTO meta VALUES ('format', ?)", (STATE_FORMAT,))
+        con.execute("INSERT INTO meta VALUES ('next_cluster_id', 0)")
+
+    con.executescript("""CREATE TABLE IF NOT EXISTS records
+                             (record_id PRIMARY KEY, record_hash BLOB,
+                              cluster_id INTEGER, confidence REAL);
+                         CREATE TABLE IF NOT EXISTS blocking_map
+                             (block_key TEXT, record_id);
+                         CREATE INDEX IF NOT EXISTS blocking_map_key_idx
+                             ON blocking_map (block_key);
+                         CREATE INDEX IF NOT EXISTS blocking_map_record_idx
+                             ON blocking_map (record_id);
+                         CREATE INDEX IF NOT EXISTS records_cluster_idx
+                             ON records (cluster_id);""")
+    return con
+
+
+def _find_changes(con, data):
+    """Internal method that drops records that were removed or changed since
+        the last run from the stored state.
+        Returns
+        -------
+        dict
+            The digests of the records that need to be blocked and clustered.
+    """
+    con.execute("CREATE TEMPORARY TABLE current_records (record_id PRIMARY KEY, record_hash BLOB)")
+    con.executemany("INSERT INTO current_records VALUES (?, ?)",
+                    ((record_id, record_digest(record)) for record_id, record in data.items()))
+
+    stale = con.execute("""SELECT r.record_id FROM records r
+                           LEFT JOIN current_records c USING (record_id)
+                           WHERE c.record_id IS NULL
+                           OR c.record_hash != r.record_hash""").fetchall()
+    con.executemany("DELETE FROM records WHERE record_id = ?", stale)
+    con.executemany("DELETE FROM blocking_map WHERE record_id = ?", stale)
+
+    new = dict(con.execute("""SELECT c.record_id, c.record_hash FROM current_records c
+                              LEFT JOIN records r USING (record_id)
+                              WHERE r.record_id IS NULL"""))
+    con.execute("DROP TABLE current_records")
+    return new
+
+
+def _block_keys(records, predicates):
+    """Internal method that yields the (block key, record id) pairs the given
+        (position, predicate) pairs of a fingerprinter produce for records.
+    """
+    predicates = [(':' + str(i), predicate) for i, predicate in predicates]
+    for record_id, record in records:
+        for pred_id, predicate in predicates:
+            for block_key in predicate(record, target=False):
+                yield block_key + pred_id, record_id
+
+
+def _candidate_pairs(con, deduper, data, new_ids):
+    """Internal method that blocks the new records and yields every pair that
+        involves at least one new record, with the smaller id first. These
+        are the pairs blocking the full table would yield for them.
+
+        The keys of predicates that only depend on the record are stored, and
+        the new records are joined against the keys stored by earlier runs.
+        Index predicates give keys that depend on every indexed record, so
+        they are never stored: their keys are computed again for the full
+        table, in the order a full run blocks it, and joined in memory.
+    """
+    fingerprinter = deduper.fingerprinter
+    static = set(static_predicates(fingerprinter))
+    record_predicates = [(i, predicate) for i, predicate in enumerate(fingerprinter.predicates)
+                         if i in static]
+    index_predicates = [(i, predicate) for i, predicate in enumerate(fingerprinter.predicates)
+                        if i not in static]
+
+    new_keys = list(_block_keys(((record_id, data[record_id]) for record_id in new_ids),
+                                record_predicates))
+    con.executemany("INSERT INTO blocking_map VALUES (?, ?)", new_keys)
+
+    con.execute("CREATE TEMPORARY TABLE index_blocking_map (block_key TEXT, record_id)")
+    if index_predicates:
+        fingerprinter.index_all(data)
+        index_keys = list(_block_keys(data.items(), index_predicates))
+        fingerprinter.reset_indices()
+
+        con.executemany("INSERT INTO index_blocking_map VALUES (?, ?)", index_keys)
+        con.execute("CREATE INDEX temp.index_blocking_map_key_idx ON index_blocking_map (block_key)")
+        new_keys.extend((block_key, record_id) for block_key, record_id in index_keys
+                        if record_id in new_ids)
+        del index_keys
+
+    con.execute("CREATE TEMPORARY TABLE new_blocking_map (block_key TEXT, record_id)")
+    con.executemany("INSERT INTO new_blocking_map VALUES (?, ?)", new_keys)
+    del new_keys
+
+    pairs = con.execute("""SELECT MIN(a.record_id, b.record_id), MAX(a.record_id, b.record_id)
+                           FROM new_blocking_map a
+                           INNER JOIN blocking_map b USING (block_key)
+                           WHERE a.record_id != b.record_id
+                           UNION
+                           SELECT MIN(a.record_id, b.record_id), MAX(a.record_id, b.record_id)
+                           FROM new_blocking_map a
+                           INNER JOIN index_blocking_map b USING (block_key)
+                           WHERE a.record_id != b.record_id""")
+
+    for a, b in pairs:
+        yield (a, data[a]), (b, data[b])
+
+    con.execute("DROP TABLE new_blocking_map")
+    con.execute("DROP TABLE index_blocking_map")
+
+
+def _score(deduper, pairs):
+    """Internal method that scores pairs, allowing for there being none."""
+    first = next(pairs, None)
+    if first is None:
+        return None
+    return deduper.score(itertools.chain([first], pairs))
+
+
+def cluster_incremental(deduper, data, threshold, settings_file, state_file):
+    """Clusters only the records that are new or changed since the last run,
+        comparing them against every stored record, and merges them into the
+        stored clusters.
+
+        Only the block keys of predicates that use no index of the data are
+        stored. Predicates that do, such as canopy and search predicates, are
+        evaluated over the full table on every run, so models made of them
+        save scoring and clustering time but not blocking time.
+
+        New records that match existing records join their cluster. When a
+        new record links records of several existing clusters, those clusters
+        are merged. Clusters that gain no members keep their confidence
+        scores. Removed or changed records are dropped from their cluster
+        before clustering.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            A trained instance of dedupe.
+        data : dict
+            The dedupe formatted data dictionary of the full table.
+        threshold : float
+            The threshold used for clustering.
+        settings_file : str
+            A path to the settings file. Stored state built with a different
+            settings file is discarded.
+        state_file : str
+            A path to the sqlite database storing the previous run's cluster
+            assignments and the block keys of its static predicates.
+        Returns
+        -------
+        list
+            The (record ids, confidence scores) clusters of the full table.
+    """
+    con = _connect(state_file, settings_digest(settings_file))
+
+    new = _find_changes(con, data)
+    print('# new or changed records', len(new))
+
+    next_cluster_id = con.execute("SELECT value FROM meta WHERE key = 'next_cluster_id'").fetchone()[0]
+    clustered = set()
+
+    if new:
+        scores = _score(deduper, _candidate_pairs(con, deduper, data, new))
+        clusters = []
+        if scores is not None:
+            if len(scores):
+                clusters = list(deduper.cluster(scores, threshold))
+            cleanup_scores(scores)
+
+        for id_set, confidences in clusters:
+            # Clustering returns numpy scalars, which sqlite would store as blobs
+            id_set = [record_id.item() for record_id in id_set]
+            old_ids = [record_id for record_id in id_set if record_id not in new]
+            old_clusters = set()
+            for start in range(0, len(old_ids), 500):
+                batch = old_ids[start:start + 500]
+                old_clusters.update(cluster_id for (cluster_id,) in con.execute(
+                    "SELECT cluster_id FROM records WHERE record_id IN (%s)" % ','.join('?' * len(batch)),
+                    batch))
+
+            if old_clusters:
+                # Merge every existing cluster this one touches
+                cluster_id = min(old_clusters)
+                con.executemany("UPDATE records SET cluster_id = ? WHERE cluster_id = ?",
+                                ((cluster_id, other) for other in old_clusters if other != cluster_id))
+            else:
+                cluster_id = next_cluster_id
+                next_cluster_id += 1
+
+            # Stored right away, so later merges also move these records
+            members = [(record_id, new[record_id], cluster_id, float(confidence))
+                       for record_id, confidence in zip(id_set, confidences)
+                       if record_id in new]
+            con.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", members)
+            clustered.update(record_id for record_id, _, _, _ in members)
+
+        # New records that did not match anything are singletons
+        singletons = []
+        for record_id in new:
+            if record_id not in clustered:
+                singletons.append((record_id, new[record_id], next_cluster_id, 1.0))
+                next_cluster_id += 1
+        con.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", singletons)
+
+    con.execute("UPDATE meta SET value = ? WHERE key = 'next_cluster_id'", (next_cluster_id,))
+    con.commit()
+
+    clusters = {}
+    for record_id, cluster_id, confidence in con.execute(
+            "SELECT record_id, cluster_id, confidence FROM records ORDER BY cluster_id"):
+        clusters.setdefault(cluster_id, ([], []))
+        clusters[cluster_id][0].append(record_id)
+        clusters[cluster_id][1].append(confidence)
+    con.close()
+
+    return [(tuple(ids), np.array(confidences)) for ids, confidences in clusters.values()]
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import logging
+from contextlib import contextmanager
+
+import dedupe
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _reset_peak_rss():
+    """Internal method that resets the peak resident set size of the process
+        to its current resident set size, so the next _peak_rss only covers
+        what follows. Returns False where this is not supported.
+    """
+    # Linux resets VmHWM when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """Internal method that returns the peak resident set size of the process
+        in bytes, or None where it is not available.
+    """
+    # Unlike ru_maxrss, VmHWM is not carried over from the parent process and
+    # can be reset
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _max_peak(a, b):
+    """Internal method that returns the larger of two peaks, either of which
+        can be None.
+    """
+    if a is None or b is None:
+        return b if a is None else a
+    return max(a, b)
+
+
+def _cpu_time():
+    """Internal method that returns the CPU time used by the process and its
+        finished child processes, such as dedupe's scoring workers.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class PipelineStats(object):
+    """Collects the wall time, CPU time, peak RSS and record and pair counts of
+        every stage of a pandas_dedupe run.
+
+        On Linux, the peak RSS is reset when a stage starts, so peak_rss is
+        the peak of that stage alone. Where it cannot be reset, the peak of
+        the process so far is recorded as process_peak_rss instead.
+
+        Pass an instance as the stats argument of dedupe_dataframe,
+        gazetteer_dataframe or link_dataframes, and read it once the call
+        returns. Every finished stage is also logged at INFO level on the
+        pandas_dedupe.instrumentation logger and passed to callback.
+        Parameters
+        ----------
+        callback : callable, default None
+            Called with the dictionary of every stage once it finishes.
+        block_sizes : bool, default False
+            If True, dedupe_dataframe also records a histogram of blocking
+            block sizes. This costs an extra blocking pass over the data.
+    """
+
+    def __init__(self, callback=None, block_sizes=False):
+        self.callback = callback
+        self.collect_block_sizes = block_sizes
+        self.stages = []
+        self.block_sizes = None
+        # The peaks of the stages that are running, outermost first
+        self._open_peaks = []
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """Times a stage. Yields the stage dictionary, so the caller can add
+            counts to it while the stage runs.
+        """
+        record = {'stage': name}
+        record.update(counts)
+
+        # Resetting the peak would lose the peak of the stages this one is
+        # nested in so far, so it is kept for them first
+        self._fold_peak(_peak_rss())
+        resettable = _reset_peak_rss()
+        self._open_peaks.append(None)
+
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_time()
+        try:
+            yield record
+        finally:
+            peak = self._open_peaks.pop()
+
+        record['wall_time'] = time.perf_counter() - wall_start
+        record['cpu_time'] = _cpu_time() - cpu_start
+        peak = _max_peak(peak, _peak_rss())
+        record['peak_rss' if resettable else 'process_peak_rss'] = peak
+        self._fold_peak(peak)
+        self.stages.append(record)
+
+        logger.info('%s', record)
+        if self.callback is not None:
+            self.callback(record)
+
+    @contextmanager
+    def count_pairs(self, deduper, record):
+        """Counts the pairs of records deduper scores while the context is
+            active, and stores the total in record['pairs'].
+        """
+        original = deduper.score
+        gazetteer = isinstance(deduper, dedupe.api.GazetteerMatching)
+        record['pairs'] = 0
+
+        def counted(pairs):
+            for item in pairs:
+                # Gazetteers score blocks of pairs, the others single pairs
+                record['pairs'] += len(item) if gazetteer else 1
+                yield item
+
+        # score is usually a method of the class, but may already be
+        # wrapped on the instance, for example by an outer count_pairs
+        wrapped = 'score' in vars(deduper)
+        deduper.score = lambda pairs: original(counted(pairs))
+        try:
+            yield
+        finally:
+            if wrapped:
+                deduper.score = original
+            else:
+                del deduper.score
+
+    def _fold_peak(self, peak):
+        """Internal method that records peak in the stages that are running."""
+        self._open_peaks = [_max_peak(open_peak, peak) for open_peak in self._open_peaks]
+
+    def to_frame(self):
+        """Returns the stages as a dataframe, one row per stage."""
+        return pd.DataFrame(self.stages)
+
+    def __repr__(self):
+        return 'PipelineStats(%s)' % ', '.join(
+            '%s=%.3fs' % (record['stage'], record['wall_time']) for record in self.stages)
+
+
+class NullStats(PipelineStats):
+    """Stands in for PipelineStats when the caller asked for no statistics.
+        Stages are neither timed nor recorded, pairs are not counted, and the
+        peak RSS of the process is never reset.
+    """
+
+    @contextmanager
+    def stage(self, name, **counts):
+        record = {'stage': name}
+        record.update(counts)
+        yield record
+
+    @contextmanager
+    def count_pairs(self, deduper, record):
+        yield
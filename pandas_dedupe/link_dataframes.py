@@ -1,9 +1,14 @@
 from pandas_dedupe.utility_functions import *
+from pandas_dedupe.records import records_from_dataframe
+from pandas_dedupe.instrumentation import NullStats
+from pandas_dedupe.out_of_core import join_on_disk
 
 import os
 import logging
+import math
 
 import dedupe
+import numpy as np
 
 
 import pandas as pd
@@ -11,8 +16,261 @@ import pandas as pd
 
 
 
-def link_dataframes(dfa, dfb, field_properties, config_name="link_dataframes", n_cores=None):
+# dedupe samples at most this many record pairs for training
+MAX_SAMPLE_SIZE = 15000
+
+
+def _sample_size(data_1, data_2, sample_size):
+    """Internal method that turns the sample_size fraction into the number of
+        record pairs to sample, relative to the smaller of the two datasets.
+    """
+    return max(min(math.floor(min(len(data_1), len(data_2)) * sample_size), MAX_SAMPLE_SIZE), 1)
+
+
+def _active_learning(linker, training_file, settings_file):
+    """Internal method that trains the linker model using active learning.
+        Parameters
+        ----------
+        linker : a dedupe.RecordLink instance, prepared for training
+        training_file : str
+            A path to the training file the labeled examples are saved to.
+        settings_file : str
+            A path to the settings file the trained model is saved to.
+        Returns
+        -------
+        dedupe.RecordLink
+            A trained linker instance.
+    """
+    # ## Active learning
+    # Dedupe will find the next pair of records
+    # it is least certain about and ask you to label them as matches
+    # or not.
+    # use 'y', 'n' and 'u' keys to flag duplicates
+    # press 'f' when you are finished
+    print('Starting active labeling...')
+
+    dedupe.console_label(linker)
+    linker.train()
+
+    # When finished, save our training away to disk
+    with open(training_file, 'w') as tf :
+        linker.write_training(tf)
+
+    # Save our weights and predicates to disk.  If the settings file
+    # exists, we will skip all the training and learning next time we run
+    # this file.
+    with open(settings_file, 'wb') as sf :
+        linker.write_settings(sf)
+
+    return linker
+
+
+def _train(settings_file, training_file, data_1, data_2, field_properties, sample_size,
+           update_model, n_cores):
+    """Internal method that loads the linker from the settings file, or trains
+        it with active learning if there is none.
+        Parameters
+        ----------
+        settings_file : str
+            A path to a settings file that will be loaded if it exists.
+        training_file : str
+            A path to a training file that will be loaded to keep training
+            from.
+        data_1, data_2 : dict
+            The dictionary forms of the dataframes that dedupe requires.
+        field_properties : dict
+            The mapping of fields to their respective data types. Please
+            see the dedupe documentation for further details.
+        sample_size : float, default 0.3
+            Specify the sample size used for training as a float from 0 to 1.
+        update_model : bool, default False
+            If True, it allows user to update existing model by uploading
+            training file.
+        n_cores : int, default None
+            Specify the number of cores to use during linking.
+        Returns
+        -------
+        dedupe.RecordLink
+            A linker instance.
+    """
+    # If a settings file already exists, we'll just load that and skip
+    # training, without touching the training file or the console
+    if update_model == False and os.path.exists(settings_file):
+        print('Reading from', settings_file)
+        with open(settings_file, 'rb') as sf :
+            return dedupe.StaticRecordLink(sf, num_cores=n_cores)
+
+    # Define the fields the linker will pay attention to
+    fields = []
+    select_fields(fields, field_properties)
+
+    # Create a new linker object and pass our data model to it.
+    linker = dedupe.RecordLink(fields, num_cores=n_cores)
+
+    # To train the linker, we feed it a sample of records.
+    sample_num = _sample_size(data_1, data_2, sample_size)
+
+    # If we have training data saved from a previous run of linker,
+    # look for it an load it in. It is required to update the model.
+    # __Note:__ if you want to train from scratch, delete the training_file
+    if update_model or os.path.exists(training_file):
+        print('Reading labeled examples from ', training_file)
+        with open(training_file) as tf :
+            linker.prepare_training(data_1, data_2, training_file=tf, sample_size=sample_num)
+    else:
+        linker.prepare_training(data_1, data_2, sample_size=sample_num)
+
+    return _active_learning(linker, training_file, settings_file)
+
+
+def _link_results(dfa, dfb, keys_a, keys_b, linked_records, link_table=False):
+    """Internal method that turns the links into a results dataframe.
+        Parameters
+        ----------
+        dfa, dfb : pd.DataFrame
+            The cleaned dataframes.
+        keys_a, keys_b : pd.Index
+            The record keys of the rows of dfa and dfb.
+        linked_records : list
+            The ((dfa key, dfb key), confidence) links returned by join.
+        link_table : bool, default False
+            If True, only the links are returned.
+        Returns
+        -------
+        pd.DataFrame
+            The rows of dfa followed by the rows of dfb, with the cluster id
+            and confidence of their link, sorted by cluster id. Or, if
+            link_table is True, one row per link.
+    """
+    n_links = len(linked_records)
+    link_a = np.empty(n_links, dtype=object)
+    link_b = np.empty(n_links, dtype=object)
+    confidences = np.empty(n_links, dtype=np.float32)
+    cluster_ids = np.empty(n_links, dtype=np.int64)
+    for i, (link, score) in enumerate(linked_records):
+        link_a[i], link_b[i] = link
+        confidences[i] = score
+        cluster_ids[i] = stable_cluster_id(link)
+
+    # Positions of the linked records in dfa and dfb
+    pos_a = keys_a.get_indexer(link_a)
+    pos_b = keys_b.get_indexer(link_b)
+
+    if link_table:
+        return pd.DataFrame({'dfa id': dfa.index[pos_a],
+                             'dfb id': dfb.index[pos_b],
+                             'confidence': confidences,
+                             'cluster id': cluster_ids})
+
+    parts = []
+    for df, pos in ((dfa, pos_a), (dfb, pos_b)):
+        # Nullable integers, so unlinked rows don't turn the 63 bit ids into floats
+        linked = np.zeros(len(df), dtype=bool)
+        linked[pos] = True
+        df_cluster_ids = np.zeros(len(df), dtype=np.int64)
+        df_cluster_ids[pos] = cluster_ids
+        df_confidences = np.full(len(df), np.nan, dtype=np.float32)
+        df_confidences[pos] = confidences
+
+        df = df.reset_index(drop=True)
+        df['cluster id'] = pd.arrays.IntegerArray(df_cluster_ids, ~linked)
+        df['confidence'] = df_confidences
+        parts.append(df)
+
+    #Concatenate results from dfa + dfb
+    df_final = pd.concat(parts, ignore_index=True, sort=True)
+    return df_final.sort_values(by=['cluster id'], kind='mergesort')
+
+
+def _prepare(df, field_properties, prefix):
+    """Internal method that cleans and types a dataframe and builds its
+        records, keyed by the index prefixed with prefix, so that keys differ
+        between dfa and dfb.
+        Returns
+        -------
+        tuple
+            The cleaned dataframe, the record keys and the records.
+    """
+    df = clean_punctuation(df)
+    specify_type(df, field_properties)
+
+    keys = prefix + df.index.astype(str)
+    data = records_from_dataframe(df, field_names(field_properties), lazy=True, index=keys)
+    return df, keys, data
+
+
+def _link(linker, dfa, dfb, keys_a, keys_b, data_1, data_2, threshold, link_table, on_disk, stats):
+    """Internal method that links the records prepared by _prepare with a
+        trained linker and builds the results.
+    """
+    print('Clustering...')
+    with stats.stage('join') as stage, stats.count_pairs(linker, stage):
+        if on_disk:
+            linked_records = join_on_disk(linker, data_1, data_2, threshold)
+        else:
+            linked_records = linker.join(data_1, data_2, threshold)
+        stage['links'] = len(linked_records)
+
+    print('# duplicate sets', len(linked_records))
     
+
+    with stats.stage('results'):
+        df_final = _link_results(dfa, dfb, keys_a, keys_b, linked_records, link_table)
+
+    return df_final
+
+
+def link_dataframes(dfa, dfb, field_properties, config_name="link_dataframes", n_cores=None,
+                    update_model=False, threshold=0, sample_size=0.3, link_table=False, on_disk=False,
+                    stats=None):
+    """Links the records of two dataframes given fields of interest.
+        Parameters
+        ----------
+        dfa : pd.DataFrame
+            The first dataframe to link.
+        dfb : pd.DataFrame
+            The second dataframe to link.
+        field_properties : list
+            A list specifying what fields to use for linking records.
+        config_name : str, default link_dataframes
+            The configuration file name. Note that this will be used as 
+            a prefix to save the settings and training files.
+        n_cores : int, default None
+            Specify the number of cores to use during linking.
+            By default n_cores is equal to None (i.e. use multipressing equal to CPU count).
+        update_model : bool, default False
+            If True, it allows user to update existing model by uploading
+            training file.
+        threshold : float, default 0
+            Only link records whose estimated probability of referring to the
+            same entity is above the threshold.
+        sample_size : float, default 0.3
+            Specify the sample size used for training as a float from 0 to 1,
+            relative to the smaller dataframe and capped at 15000 pairs.
+            By default it is 30% (0.3) of the smaller dataframe.
+        link_table : bool, default False
+            If True, only a compact table of the links is returned, with the
+            columns dfa id, dfb id, confidence and cluster id, where the ids
+            are index values of dfa and dfb.
+        on_disk : bool, default False
+            If True, scored pairs are kept in a temporary on-disk store rather
+            than in memory while records are linked, so memory does not grow
+            with the number of pairs. Use it for large dataframes, together
+            with a threshold to keep the store small.
+        stats : PipelineStats, default None
+            If provided, the wall time, CPU time, peak memory and record and
+            pair counts of every stage are recorded in it.
+
+        Returns
+        -------
+        pd.DataFrame
+            The rows of dfa followed by the rows of dfb, sorted by cluster id,
+            with the cluster id and confidence of their link. Unlinked rows
+            have neither.
+    """
+    if stats is None:
+        stats = NullStats()
+
     config_name = config_name.replace(" ", "_")
     
     settings_file = config_name + '_learned_settings'
@@ -20,81 +278,19 @@ def link_dataframes(dfa, dfb, field_properties, config_name="link_dataframes", n
  
     print('Importing data ...')
 
-    dfa = clean_punctuation(dfa)
-    specify_type(dfa, field_properties)
-    
-    dfa['index_field'] = dfa.index
-    dfa['index_field'] = dfa['index_field'].apply(lambda x: "dfa" + str(x))
-    dfa.set_index(['index_field'], inplace=True)
-            
-    data_1 = dfa.to_dict(orient='index')
-   
-
-    dfb = clean_punctuation(dfb)
-    specify_type(dfb, field_properties)
-    
-    dfb['index_field'] = dfb.index
-    dfb['index_field'] = dfb['index_field'].apply(lambda x: "dfb" + str(x))
-    dfb.set_index(['index_field'], inplace=True)
+    with stats.stage('prepare_dfa', records=len(dfa)):
+        dfa, keys_a, data_1 = _prepare(dfa, field_properties, 'dfa')
 
-    
-    data_2 = dfb.to_dict(orient='index')
+    with stats.stage('prepare_dfb', records=len(dfb)):
+        dfb, keys_b, data_2 = _prepare(dfb, field_properties, 'dfb')
     # ---------------------------------------------------------------------------------
 
 
 
     # ## Training
-
-
-    if os.path.exists(settings_file):
-        print('Reading from', settings_file)
-        with open(settings_file, 'rb') as sf :
-            linker = dedupe.StaticRecordLink(sf, num_cores=n_cores)
-
-    else:
-        # Define the fields the linker will pay attention to
-        #
-        # Notice how we are telling the linker to use a custom field comparator
-        # for the 'price' field. 
-
-        fields = []
-        select_fields(fields, field_properties)
-                
-              
-                
-        # Create a new linker object and pass our data model to it.
-        linker = dedupe.RecordLink(fields, num_cores=n_cores)
-        # To train the linker, we feed it a sample of records.
-        linker.prepare_training(data_1, data_2, sample_size=15000)
-
-        # If we have training data saved from a previous run of linker,
-        # look for it an load it in.
-        # __Note:__ if you want to train from scratch, delete the training_file
-        if os.path.exists(training_file):
-            print('Reading labeled examples from ', training_file)
-            with open(training_file) as tf :
-                linker.prepare_training(data, training_file=tf)
-
-        # ## Active learning
-        # Dedupe will find the next pair of records
-        # it is least certain about and ask you to label them as matches
-        # or not.
-        # use 'y', 'n' and 'u' keys to flag duplicates
-        # press 'f' when you are finished
-        print('Starting active labeling...')
-
-        dedupe.console_label(linker)
-        linker.train()
-
-        # When finished, save our training away to disk
-        with open(training_file, 'w') as tf :
-            linker.write_training(tf)
-
-        # Save our weights and predicates to disk.  If the settings file
-        # exists, we will skip all the training and learning next time we run
-        # this file.
-        with open(settings_file, 'wb') as sf :
-            linker.write_settings(sf)
+    with stats.stage('train'):
+        linker = _train(settings_file, training_file, data_1, data_2, field_properties,
+                        sample_size, update_model, n_cores)
 
 
     # ## Blocking
@@ -108,32 +304,4 @@ def link_dataframes(dfa, dfb, field_properties, config_name="link_dataframes", n
     # If we had more data, we would not pass in all the blocked data into
     # this function but a representative sample.
 
-    print('Clustering...')
-    linked_records = linker.join(data_1, data_2, 0)
-
-    print('# duplicate sets', len(linked_records))
-    
-
-    #Convert linked records into dataframe
-    df_linked_records = pd.DataFrame(linked_records)
-    
-    df_linked_records['dfa_link'] = df_linked_records[0].apply(lambda x: x[0])
-    df_linked_records['dfb_link'] = df_linked_records[0].apply(lambda x: x[1])
-    df_linked_records.rename(columns={1: 'confidence'}, inplace=True)
-    df_linked_records.drop(columns=[0], inplace=True)
-    df_linked_records['cluster id'] = df_linked_records.index
-
-   
-    #For both dfa & dfb, add cluster id & confidence score from liked_records
-    dfa.index.rename('dfa_link', inplace=True)
-    dfa = dfa.merge(df_linked_records, on='dfa_link', how='left')
-
-    dfb.index.rename('dfb_link', inplace=True)
-    dfb = dfb.merge(df_linked_records, on='dfb_link', how='left')
-
-    #Concatenate results from dfa + dfb
-    df_final = dfa.append(dfb, ignore_index=True, sort=True)
-    df_final = df_final.sort_values(by=['cluster id'])
-    df_final = df_final.drop(columns=['dfa_link','dfb_link'])
-
-    return df_final
+    return _link(linker, dfa, dfb, keys_a, keys_b, data_1, data_2, threshold, link_table, on_disk, stats)
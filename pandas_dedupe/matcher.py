@@ -0,0 +1,181 @@
+"""Record at a time gazetteer matching, for online lookups."""
+import asyncio
+
+from pandas_dedupe.utility_functions import normalize_string
+from pandas_dedupe.session import GazetteerSession
+from pandas_dedupe.gazetteer_dataframe import _find_matches
+
+
+class GazetteerMatcher(GazetteerSession):
+    """Matches single records against a gazette with a model trained by
+        gazetteer_dataframe.
+
+        The settings file is loaded, and the gazette cleaned and indexed, once
+        when the matcher is built. Records are dictionaries holding the
+        field_properties column, cleaned like gazetteer_dataframe cleans the
+        messy dataframe, and are scored in the calling process.
+        Parameters
+        ----------
+        clean_data : pd.DataFrame
+            The gazetteer dataframe.
+        field_properties : str
+            The key of the value to match in every record.
+        config_name : str, default gazetteer_dataframe
+            The configuration name the model was trained with.
+        threshold : float, default 0.3
+            Only gazette records scoring above the threshold are returned.
+        n_matches : int, default 1
+            The number of best matches returned per record.
+        canonicalize : bool, default False
+            If True, every match holds the cleaned gazette value as well.
+        cache_index : bool, default False
+            If True, the gazette index is loaded from, or saved to, the
+            persisted index of gazetteer_dataframe, so a matcher started in a
+            new process reuses the blocking keys of the gazette. Predicates
+            that use an index of the gazette index it again.
+        candidates : str or NgramIndex, default None
+            If provided, candidates are looked up in an n-gram index instead of
+            the learned blocks, as in gazetteer_dataframe.
+        n_candidates : int, default 10
+            The number of candidates scored per record.
+        max_batch_size : int, default 64
+            The largest batch match_async sends to match_many.
+        batch_delay : float, default 0.002
+            How long, in seconds, match_async waits for more records before
+            matching a batch that is not full.
+    """
+
+    def __init__(self, clean_data, field_properties, config_name="gazetteer_dataframe", threshold=0.3,
+                 n_matches=1, canonicalize=False, cache_index=False, candidates=None, n_candidates=10,
+                 max_batch_size=64, batch_delay=0.002):
+        super(GazetteerMatcher, self).__init__(clean_data, field_properties, config_name, n_cores=0,
+                                               cache_index=cache_index, candidates=candidates,
+                                               n_candidates=n_candidates)
+        self.threshold = threshold
+        self.n_matches = n_matches
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+
+        self._canonical = None
+        if canonicalize:
+            self._canonical = dict(zip(self.gazette.index, self.gazette[self.common_name]))
+
+        self._pending = []
+        self._flush_handle = None
+
+    def add(self, clean_data):
+        """Adds records to the gazette, see GazetteerSession.add."""
+        super(GazetteerMatcher, self).add(clean_data)
+        if self._canonical is not None:
+            added = self.gazette.loc[clean_data.index, self.common_name]
+            self._canonical.update(zip(added.index, added))
+
+    def remove(self, ids):
+        """Removes records from the gazette, see GazetteerSession.remove."""
+        ids = list(ids)
+        super(GazetteerMatcher, self).remove(ids)
+        if self._canonical is not None:
+            for record_id in ids:
+                del self._canonical[record_id]
+
+    def _record(self, record):
+        """Internal method that cleans a record like clean_punctuation and
+            specify_type clean a row of the messy dataframe.
+        """
+        return {self.common_name: normalize_string(str(record[self.field_properties]))}
+
+    def _matches(self, matches):
+        """Internal method that formats the matches of a record."""
+        results = []
+        for canon_id, score in matches:
+            match = {'cluster id': canon_id, 'confidence': float(score)}
+            if self._canonical is not None:
+                match['canonical_' + str(self.field_properties)] = self._canonical[canon_id]
+            results.append(match)
+        return results
+
+    def match(self, record):
+        """Matches a single record.
+            Parameters
+            ----------
+            record : dict
+                The record, holding the field_properties key.
+            Returns
+            -------
+            list
+                A dictionary with the cluster id (the gazette index) and
+                confidence of every match, best first. Empty if nothing in the
+                gazette scores above the threshold.
+        """
+        return self.match_many([record])[0]
+
+    def match_many(self, records):
+        """Matches several records at once, which is faster than matching them
+            one by one.
+            Parameters
+            ----------
+            records : list of dict
+                The records, each holding the field_properties key.
+            Returns
+            -------
+            list
+                The matches of every record, in the order of records, as
+                returned by match.
+        """
+        if not records:
+            return []
+
+        messy = {i: self._record(record) for i, record in enumerate(records)}
+        with self._call(len(messy)):
+            matches = dict(_find_matches(self.model, messy, self.threshold, self.n_matches, self.candidates))
+
+        return [self._matches(matches.get(i, ())) for i in range(len(records))]
+
+    async def match_async(self, record):
+        """Matches a single record from a coroutine. Records submitted by
+            concurrent calls are batched together, and every batch is matched
+            by match_many in a worker thread, so the event loop is not blocked.
+            Returns
+            -------
+            list
+                The matches of the record, as returned by match.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_delay, self._flush, loop)
+
+        return await future
+
+    def _flush(self, loop):
+        """Internal method that matches the pending records of match_async."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        records = [record for record, _ in batch]
+        futures = [future for _, future in batch]
+
+        def resolve(task):
+            if task.cancelled():
+                for future in futures:
+                    future.cancel()
+                return
+            if task.exception() is not None:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(task.exception())
+                return
+            for future, matches in zip(futures, task.result()):
+                if not future.done():
+                    future.set_result(matches)
+
+        loop.run_in_executor(None, self.match_many, records).add_done_callback(resolve)
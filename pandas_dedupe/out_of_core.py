@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import logging
+import tempfile
+
+import dedupe
+import dedupe.core
+
+from pandas_dedupe.utility_functions import cleanup_scores
+
+
+# The number of scored pairs copied into the store at a time
+CHUNKSIZE = 100000
+
+
+def _spill(con, scores, threshold, chunksize):
+    """Internal method that copies the pairs scoring above the threshold into
+        the scores table, chunk by chunk.
+    """
+    con.execute('CREATE TABLE scores (a INTEGER, b INTEGER, score REAL)')
+    for start in range(0, len(scores), chunksize):
+        chunk = scores[start:start + chunksize]
+        chunk = chunk[chunk['score'] > threshold]
+        con.executemany('INSERT INTO scores VALUES (?, ?, ?)',
+                        zip(chunk['pairs'][:, 0].tolist(), chunk['pairs'][:, 1].tolist(),
+                            chunk['score'].tolist()))
+    con.execute('CREATE INDEX scores_idx ON scores (score DESC, a, b)')
+    con.commit()
+
+
+def join_on_disk(linker, data_1, data_2, threshold=0, chunksize=CHUNKSIZE):
+    """Links two datasets one-to-one without holding the scored pairs in memory.
+
+        Records are compared under integer ids, so dedupe writes the scores
+        to a compact memory-mapped file. Pairs above the threshold are copied
+        from it into a temporary SQLite database, the memory-mapped file is
+        removed, and pairs are read back in order of decreasing score to
+        greedily keep each record's best remaining link, as
+        RecordLink.one_to_one does. Memory grows with the number of records
+        and links, not with the number of scored pairs.
+        Parameters
+        ----------
+        linker : dedupe.RecordLink
+            A trained linker.
+        data_1, data_2 : dict
+            The dedupe formatted data dictionaries to link.
+        threshold : float, default 0
+            Only pairs scoring above the threshold are stored and linked.
+        chunksize : int, default CHUNKSIZE
+            The number of scored pairs copied into the store at a time.
+        Returns
+        -------
+        list
+            The ((data_1 id, data_2 id), confidence) links, like RecordLink.join.
+    """
+    keys_1 = list(data_1)
+    keys_2 = list(data_2)
+    offset = len(keys_1)
+    records_1 = dict(zip(range(offset), data_1.values()))
+    records_2 = dict(zip(range(offset, offset + len(keys_2)), data_2.values()))
+
+    try:
+        scores = linker.score(linker.pairs(records_1, records_2))
+    except dedupe.core.BlockingError:
+        logging.warning('No records have been blocked together.')
+        return []
+    del records_1, records_2
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        con = sqlite3.connect(os.path.join(temp_dir, 'scores.db'))
+        con.execute('pragma journal_mode=off')
+        con.execute('pragma synchronous=off')
+        try:
+            _spill(con, scores, threshold, chunksize)
+            cleanup_scores(scores)
+            del scores
+
+            linked_1 = set()
+            linked_2 = set()
+            links = []
+            for a, b, score in con.execute('SELECT a, b, score FROM scores ORDER BY score DESC, a, b'):
+                if a not in linked_1 and b not in linked_2:
+                    linked_1.add(a)
+                    linked_2.add(b)
+                    links.append(((keys_1[a], keys_2[b - offset]), score))
+        finally:
+            con.close()
+
+    return links
@@ -0,0 +1,111 @@
+from collections.abc import ItemsView, Mapping, ValuesView
+
+import pandas as pd
+
+from pandas_dedupe.utility_functions import _take_with_missing
+
+
+def column_values(column):
+    """Lists the values of a column as dedupe expects them. Categorical
+        columns give their categories, one shared object per distinct value,
+        and None for missing values.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return _take_with_missing(column.cat.categories.to_numpy(dtype=object),
+                                  column.cat.codes.to_numpy()).tolist()
+    return column.tolist()
+
+
+class RecordMapping(Mapping):
+    """Read-only {record id: record} view over the columns of a dataframe.
+
+        Records are built from the column arrays when they are accessed, so the
+        full dictionary of dictionaries dedupe works on is never held in memory.
+        The dataframe index, or the given record ids, must be unique.
+    """
+
+    def __init__(self, df, fields, index=None):
+        index = df.index if index is None else pd.Index(index)
+        if not index.is_unique:
+            raise ValueError('A lazy record mapping requires a unique dataframe index')
+        self.fields = list(fields)
+        self._index = index
+        self._columns = [column_values(df[field]) for field in self.fields]
+
+    def _record(self, position):
+        return {field: column[position] for field, column in zip(self.fields, self._columns)}
+
+    def __getitem__(self, record_id):
+        try:
+            position = self._index.get_loc(record_id)
+        except (KeyError, TypeError):
+            raise KeyError(record_id)
+        return self._record(position)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, record_id):
+        try:
+            return record_id in self._index
+        except TypeError:
+            return False
+
+    def items(self):
+        return _RecordItems(self)
+
+    def values(self):
+        return _RecordValues(self)
+
+
+class _RecordItems(ItemsView):
+
+    def __iter__(self):
+        for position, record_id in enumerate(self._mapping._index):
+            yield record_id, self._mapping._record(position)
+
+
+class _RecordValues(ValuesView):
+
+    def __iter__(self):
+        for position in range(len(self._mapping)):
+            yield self._mapping._record(position)
+
+
+def records_from_dataframe(df, fields=None, lazy=False, index=None):
+    """Builds the {record id: record} mapping dedupe expects from a dataframe.
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The cleaned and typed dataframe. Its index is used as record ids.
+        fields : list, default None
+            The columns to include in every record. By default all columns
+            are included.
+        lazy : bool, default False
+            If True, return a RecordMapping that builds each record on access
+            instead of materializing every record up front. Use it for records
+            that are only read. If the record ids are not unique, a dictionary
+            is returned instead, in which the last row of every id wins.
+        index : sequence, default None
+            The record ids of the rows of df. By default the index of df.
+        Returns
+        -------
+        dict or RecordMapping
+            A mapping of record ids to record dictionaries.
+    """
+    if fields is None:
+        fields = df.columns
+    fields = list(fields)
+
+    if index is None:
+        index = df.index
+    index = pd.Index(index)
+
+    if lazy and index.is_unique:
+        return RecordMapping(df, fields, index)
+    columns = [column_values(df[field]) for field in fields]
+    records = (dict(zip(fields, values)) for values in zip(*columns))
+    return dict(zip(index.tolist(), records))
@@ -0,0 +1,272 @@
+"""Long-lived model objects for matching many dataframes with one model.
+
+The entry point functions load the settings file and build a model on every
+call. A session loads it once and is then called with one dataframe after
+another, which suits services that match many small files.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import dedupe
+import pandas as pd
+
+from pandas_dedupe.utility_functions import model_field_properties
+from pandas_dedupe.records import records_from_dataframe
+from pandas_dedupe.instrumentation import NullStats
+from pandas_dedupe.dedupe_dataframe import _prepare as _prepare_dedupe, _deduplicate
+from pandas_dedupe.link_dataframes import _prepare as _prepare_link, _link
+from pandas_dedupe.gazetteer_dataframe import _index, _prepare_gazette, _search
+from pandas_dedupe.gazette_index import update_gazette
+
+
+# Inputs with fewer records are scored in the calling process, where
+# starting dedupe's scoring processes would cost more than it saves. dedupe
+# starts those processes again on every call, they are not kept by a session
+IN_PROCESS_RECORDS = 10000
+
+
+class _Session(object):
+    """Loads a settings file once and serializes calls to the model."""
+
+    model_class = None
+
+    def __init__(self, config_name, n_cores=None):
+        self.config_name = config_name.replace(" ", "_")
+        self.settings_file = self.config_name + '_learned_settings'
+        if not os.path.exists(self.settings_file):
+            raise FileNotFoundError(self.settings_file + ' does not exist. Train a model with the '
+                                    'matching entry point function first.')
+
+        print('Reading from', self.settings_file)
+        with open(self.settings_file, 'rb') as f:
+            self.model = self.model_class(f, num_cores=n_cores)
+
+        self.n_cores = os.cpu_count() if n_cores is None else n_cores
+        self.field_properties = model_field_properties(self.model)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self):
+        """The process pool of the session, started on first use and kept
+            until the session is closed.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=max(self.n_cores, 1))
+        return self._executor
+
+    @contextmanager
+    def _call(self, n_records):
+        """Runs one call at a time, scoring small inputs in process."""
+        with self._lock:
+            self.model.num_cores = self.n_cores if n_records >= IN_PROCESS_RECORDS else 0
+            try:
+                yield
+            finally:
+                self.model.num_cores = self.n_cores
+
+    def close(self):
+        """Shuts the process pool of the session down."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DedupeSession(_Session):
+    """Deduplicates dataframes with a model trained by dedupe_dataframe.
+
+        The fields and types to match are read from the settings file. Clusters
+        are canonicalized, and shards clustered, by a process pool that stays
+        up between calls. Without n_shards, inputs of at least
+        IN_PROCESS_RECORDS records are scored by processes dedupe starts for
+        every call, so pass n_shards to score large inputs in the warm pool.
+        Parameters
+        ----------
+        config_name : str, default dedupe_dataframe
+            The configuration name the model was trained with.
+        n_cores : int, default None
+            The number of processes of the session pool, and of dedupe when it
+            scores inputs of at least IN_PROCESS_RECORDS records. By default
+            it is equal to the CPU count.
+    """
+
+    model_class = dedupe.StaticDedupe
+
+    def __init__(self, config_name="dedupe_dataframe", n_cores=None):
+        super(DedupeSession, self).__init__(config_name, n_cores)
+
+    def dedupe(self, df, canonicalize=False, threshold=0.4, n_shards=None, max_block_size=None,
+               oversized_blocks='split', collapse_duplicates=False, categorical=False, cache_blocks=False,
+               stats=None):
+        """Deduplicates a dataframe. The parameters and results are those of
+            dedupe_dataframe.
+        """
+        if max_block_size and n_shards:
+            raise ValueError('max_block_size cannot be combined with n_shards')
+        if oversized_blocks not in ('split', 'skip'):
+            raise ValueError("oversized_blocks must be 'split' or 'skip'")
+
+        if stats is None:
+            stats = NullStats()
+
+        with self._call(len(df)):
+            df, data_d, data_unique, duplicates = _prepare_dedupe(
+                df, self.field_properties, canonicalize, categorical, collapse_duplicates, stats)
+
+            return _deduplicate(self.model, df, data_d, data_unique, duplicates,
+                                self.settings_file, threshold, canonicalize, self.n_cores, stats,
+                                n_shards=n_shards, executor=self.executor if n_shards else None,
+                                max_block_size=max_block_size, oversized_blocks=oversized_blocks,
+                                canonicalize_executor=self.executor if canonicalize else None,
+                                cache_file=self.config_name + '_blocking_keys.npz' if cache_blocks else None,
+                                fields=[field for field, _ in self.field_properties])
+
+
+class LinkSession(_Session):
+    """Links pairs of dataframes with a model trained by link_dataframes.
+        Parameters
+        ----------
+        config_name : str, default link_dataframes
+            The configuration name the model was trained with.
+        n_cores : int, default None
+            The number of processes dedupe scores inputs of at least
+            IN_PROCESS_RECORDS records with. dedupe starts them for every
+            call. By default it is equal to the CPU count.
+    """
+
+    model_class = dedupe.StaticRecordLink
+
+    def __init__(self, config_name="link_dataframes", n_cores=None):
+        super(LinkSession, self).__init__(config_name, n_cores)
+
+    def link(self, dfa, dfb, threshold=0, link_table=False, on_disk=False, stats=None):
+        """Links two dataframes. The parameters and results are those of
+            link_dataframes.
+        """
+        if stats is None:
+            stats = NullStats()
+
+        with self._call(len(dfa) + len(dfb)):
+            with stats.stage('prepare_dfa', records=len(dfa)):
+                dfa, keys_a, data_1 = _prepare_link(dfa, self.field_properties, 'dfa')
+            with stats.stage('prepare_dfb', records=len(dfb)):
+                dfb, keys_b, data_2 = _prepare_link(dfb, self.field_properties, 'dfb')
+
+            return _link(self.model, dfa, dfb, keys_a, keys_b, data_1, data_2,
+                         threshold, link_table, on_disk, stats)
+
+
+class GazetteerSession(_Session):
+    """Matches messy dataframes against a gazette with a model trained by
+        gazetteer_dataframe. The gazette is cleaned and indexed once.
+        Parameters
+        ----------
+        clean_data : pd.DataFrame
+            The gazetteer dataframe.
+        field_properties : str
+            The column of the messy dataframes to match.
+        config_name : str, default gazetteer_dataframe
+            The configuration name the model was trained with.
+        n_cores : int, default None
+            The number of processes dedupe scores inputs of at least
+            IN_PROCESS_RECORDS records with. dedupe starts them for every
+            call. By default it is equal to the CPU count.
+        cache_index : bool, default False
+            If True, the gazette index is persisted and reused across sessions,
+            as in gazetteer_dataframe.
+        candidates : str or NgramIndex, default None
+            If provided, candidates are looked up in an n-gram index instead of
+            the learned blocks, as in gazetteer_dataframe.
+        n_candidates : int, default 10
+            The number of candidates scored per messy record.
+    """
+
+    model_class = dedupe.StaticGazetteer
+
+    def __init__(self, clean_data, field_properties, config_name="gazetteer_dataframe",
+                 n_cores=None, cache_index=False, candidates=None, n_candidates=10):
+        super(GazetteerSession, self).__init__(config_name, n_cores)
+        self.field_properties = field_properties
+
+        self.common_name, self.gazette = _prepare_gazette(clean_data, field_properties)
+        canonical = records_from_dataframe(self.gazette, [self.common_name])
+
+        self.index_file = self.config_name + '_gazette_index' if cache_index else None
+        self.candidates = _index(self.model, canonical, self.settings_file, self.index_file,
+                                 candidates, n_candidates)
+
+    def add(self, clean_data):
+        """Adds records to the gazette. Only the new records are indexed, and
+            later searches match them. Records with the index label of a
+            gazette record replace it.
+            Parameters
+            ----------
+            clean_data : pd.DataFrame
+                The gazette records to add, with the column of the gazetteer
+                dataframe.
+        """
+        _, added_df = _prepare_gazette(clean_data, self.field_properties)
+        added_df.columns = [self.common_name]
+        added = records_from_dataframe(added_df, [self.common_name])
+
+        with self._lock:
+            self._update(added, [])
+            replaced = self.gazette.index.intersection(added_df.index)
+            self.gazette = pd.concat([self.gazette.drop(index=replaced), added_df])
+
+    def remove(self, ids):
+        """Removes records from the gazette. Later searches no longer match
+            them.
+            Parameters
+            ----------
+            ids : list
+                The index labels of the gazette records to remove.
+        """
+        ids = list(ids)
+        with self._lock:
+            self._update({}, ids)
+            self.gazette = self.gazette.drop(index=ids)
+
+    def _update(self, added, removed):
+        """Internal method that updates the gazette index, or the n-gram
+            candidates, and the persisted index if any.
+        """
+        if self.candidates is None:
+            update_gazette(self.model, added, removed, self.index_file)
+            return
+
+        index, canonical, n_candidates = self.candidates
+        missing = [record_id for record_id in removed if record_id not in canonical]
+        if missing:
+            raise KeyError('Not in the gazette index: ' + ', '.join(map(str, missing[:10])))
+
+        index.remove(removed)
+        index.add(added)
+        for record_id in removed:
+            del canonical[record_id]
+        canonical.update(added)
+
+    def search(self, messy_data, canonicalize=False, threshold=0.3, n_matches=1, stats=None):
+        """Matches a messy dataframe against the gazette. The parameters and
+            results are those of gazetteer_dataframe.
+        """
+        if stats is None:
+            stats = NullStats()
+
+        canonical_df = None
+        if canonicalize:
+            canonical_df = self.gazette.add_prefix('canonical_')
+
+        with self._call(len(messy_data)), \
+                stats.stage('search', records=len(messy_data)) as stage, \
+                stats.count_pairs(self.model, stage):
+            return _search(self.model, messy_data, self.field_properties, self.common_name,
+                           threshold, canonical_df, n_matches, self.candidates)
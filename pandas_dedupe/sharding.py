@@ -0,0 +1,177 @@
+import io
+import heapq
+import logging
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import dedupe
+import dedupe.core
+import numpy as np
+
+from pandas_dedupe.utility_functions import cleanup_scores
+
+
+def _connected_records(deduper, data):
+    """Internal method that blocks the records once and groups them into the
+        connected components of the blocking graph, where two records are
+        connected if they share a blocking key. No pair dedupe would compare
+        spans two components.
+        Returns
+        -------
+        tuple
+            The record ids of every component, largest first, and the
+            {record id: [block codes]} blocking map, where every distinct
+            block key is replaced by an integer code.
+    """
+    parent = {}
+
+    def find(record_id):
+        root = record_id
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[record_id] != root:
+            parent[record_id], record_id = root, parent[record_id]
+        return root
+
+    blocking_map = {}
+    for record_id in data:
+        parent[record_id] = record_id
+        blocking_map[record_id] = []
+
+    deduper.fingerprinter.index_all(data)
+    block_owner = {}
+    for block_key, record_id in deduper.fingerprinter(data.items()):
+        code, owner = block_owner.setdefault(block_key, (len(block_owner), record_id))
+        blocking_map[record_id].append(code)
+        if owner != record_id:
+            parent[find(record_id)] = find(owner)
+    deduper.fingerprinter.reset_indices()
+    del block_owner
+
+    components = {}
+    for record_id in data:
+        components.setdefault(find(record_id), []).append(record_id)
+
+    return sorted(components.values(), key=len, reverse=True), blocking_map
+
+
+def _assign_shards(components, n_shards):
+    """Internal method that packs components into n_shards shards of similar
+        size, placing the largest components first.
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0, i) for i in range(n_shards)]
+    for component in components:
+        load, i = heapq.heappop(loads)
+        shards[i].extend(component)
+        heapq.heappush(loads, (load + len(component), i))
+    return [shard for shard in shards if shard]
+
+
+def _shard_pairs(records, blocking_map):
+    """Internal method that yields the pairs of records that share a block
+        code, once each and with the smaller id first, like Dedupe.pairs.
+    """
+    id_type = dedupe.core.sqlite_id_type(records)
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE blocking_map (block_key INTEGER, record_id %s)' % id_type)
+    con.executemany('INSERT INTO blocking_map VALUES (?, ?)',
+                    ((code, record_id) for record_id, codes in blocking_map.items() for code in codes))
+    con.execute('CREATE INDEX block_key_idx ON blocking_map (block_key)')
+
+    pairs = con.execute("""SELECT DISTINCT a.record_id, b.record_id
+                           FROM blocking_map a
+                           INNER JOIN blocking_map b USING (block_key)
+                           WHERE a.record_id < b.record_id""")
+    for a, b in pairs:
+        yield (a, records[a]), (b, records[b])
+    con.close()
+
+
+def _partition_shard(settings, records, blocking_map, threshold):
+    """Internal method run by the workers. Loads the model from the settings
+        file contents, then scores and clusters the pairs of one shard, as
+        given by the block codes computed by _connected_records.
+    """
+    deduper = dedupe.StaticDedupe(io.BytesIO(settings), num_cores=0)
+    try:
+        scores = deduper.score(_shard_pairs(records, blocking_map))
+    except dedupe.core.BlockingError:
+        return [((record_id,), np.array([1.0])) for record_id in records]
+
+    clusters = [(tuple(ids), np.asarray(scores)) for ids, scores in deduper.cluster(scores, threshold)]
+    cleanup_scores(scores)
+
+    clustered = {record_id for ids, _ in clusters for record_id in ids}
+    clusters.extend(((record_id,), np.array([1.0])) for record_id in records if record_id not in clustered)
+    return clusters
+
+
+def partition_sharded(deduper, data, threshold, settings_file, n_shards, executor=None):
+    """Partitions the data shard by shard.
+
+        Records are blocked once, in the calling process, and grouped by
+        shared blocking keys into connected components, which are packed into
+        n_shards shards. Every shard is sent to a worker with the block codes
+        of its records, so workers only score and cluster: blocking a shard
+        on its own would rebuild index predicates over a subset of the data
+        and give other blocks. As no blocked pair spans two components, the
+        clusters of all shards are simply combined, and are the same as
+        clustering all records at once. Records that share no blocking key
+        with any other record are returned as singletons without being sent
+        to a worker.
+        Parameters
+        ----------
+        deduper : dedupe.Deduper
+            A trained instance of dedupe, used to compute blocking keys.
+        data : dict
+            The dedupe formatted data dictionary.
+        threshold : float
+            The threshold used for clustering.
+        settings_file : str
+            A path to the settings file that workers load the model from.
+        n_shards : int
+            The number of shards to split the data into.
+        executor : concurrent.futures.Executor, default None
+            The executor that runs the shards. Any object with a
+            concurrent.futures style submit method can be used, such as a
+            dask.distributed Client. By default a ProcessPoolExecutor with
+            n_shards workers is used.
+        Returns
+        -------
+        list
+            The (record ids, confidence scores) clusters of every shard.
+    """
+    components, blocking_map = _connected_records(deduper, data)
+
+    clustered_dupes = [((c[0],), np.array([1.0])) for c in components if len(c) == 1]
+    components = [c for c in components if len(c) > 1]
+
+    if components and len(components[0]) > len(data) / n_shards:
+        logging.warning('The largest group of records sharing blocking keys holds %d of %d records. '
+                        'Its shard cannot be split further.', len(components[0]), len(data))
+
+    shards = _assign_shards(components, n_shards)
+    print('# shards', len(shards))
+
+    with open(settings_file, 'rb') as f:
+        settings = f.read()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_shards)
+
+    try:
+        futures = [executor.submit(_partition_shard, settings,
+                                   {record_id: data[record_id] for record_id in shard},
+                                   {record_id: blocking_map[record_id] for record_id in shard},
+                                   threshold)
+                   for shard in shards]
+        for future in futures:
+            clustered_dupes.extend(future.result())
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return clustered_dupes
@@ -1,7 +1,25 @@
+from ast import literal_eval
+from functools import lru_cache
+import os
+import pickle
+import hashlib
+import re
+
 from unidecode import unidecode
 import pandas as pd
 import numpy as np
-from ast import literal_eval
+
+
+PUNCTUATION = re.compile(r'[^\w\s\.\-\(\)\,\:\/\\]')
+NULL_STRINGS = {'nan', 'none', 'nat'}
+NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+SPACE = r'[^\S\n]*'
+# An optionally parenthesised pair of numbers, as literal_eval would read it.
+# One value per line, so a whole column can be matched in a single pass.
+LATLONG = re.compile(r'^' + SPACE + r'(\()?' + SPACE + '(' + NUMBER + ')' + SPACE + ',' + SPACE
+                     + '(' + NUMBER + ')' + SPACE + ',?' + SPACE + r'(?(1)\))' + SPACE + '$', re.M)
+LATLONG_ERROR = "Make sure that LatLong columns are tuples arranged like ('lat', 'lon')"
+
 
 def trim(x):
     x = x.split()
@@ -9,17 +27,113 @@ def trim(x):
     return x   
 
 
-def clean_punctuation(df):
-    for i in df.columns:
-        df[i] = df[i].astype(str) 
-    df = df.applymap(lambda x: x.lower())
-    for i in df.columns:
-        df[i] = df[i].str.replace('[^\w\s\.\-\(\)\,\:\/\\\\]','')
-    df = df.applymap(lambda x: trim(x))
-    df = df.applymap(lambda x: unidecode(x))
-    for i in df.columns:
-        df[i] = df[i].replace({'nan': None, 'none': None, 'nat': None})
-    return df
+@lru_cache(maxsize=2 ** 16)
+def normalize_string(x):
+    """Lowercase, strip punctuation, collapse whitespace and transliterate
+        a single string. Returns None for the string forms of missing values.
+        Results are cached, so repeated values are only normalized once.
+    """
+    x = unidecode(trim(PUNCTUATION.sub('', x.lower())))
+    if x in NULL_STRINGS:
+        return None
+    return x
+
+
+def _take_with_missing(values, codes, missing=None):
+    """Internal method that maps the codes of a factorized column, or of a
+        categorical, to its distinct values, an array. The -1 code pandas
+        gives missing values maps to missing.
+    """
+    return np.append(values, missing)[codes]
+
+
+def clean_column(column, categorical=False):
+    """Normalize a column with normalize_string, calling it once per distinct
+        value rather than once per cell. Equal cleaned values share a single
+        string object. If categorical is True, the column is returned as a
+        categorical, storing every distinct cleaned value once.
+    """
+    codes, uniques = pd.factorize(column.astype(str))
+    cleaned = np.array([normalize_string(u) for u in uniques], dtype=object)
+    if categorical:
+        # Distinct raw values can clean to the same value, or to None
+        cleaned_codes, categories = pd.factorize(cleaned)
+        values = pd.Categorical.from_codes(_take_with_missing(cleaned_codes, codes, -1), categories)
+        return pd.Series(values, index=column.index, name=column.name)
+    return pd.Series(_take_with_missing(cleaned, codes), index=column.index, name=column.name)
+
+
+def clean_punctuation(df, fields=None, categorical=False):
+    """Clean the columns of a dataframe with clean_column.
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The dataframe to clean.
+        fields : list, default None
+            The columns to clean. The other columns are passed through as
+            they are. By default every column is cleaned.
+        categorical : bool, default False
+            If True, cleaned columns are stored as categoricals.
+        Returns
+        -------
+        pd.DataFrame
+            A new dataframe with the same columns and index as df.
+    """
+    if fields is None:
+        cleaned = pd.DataFrame({j: clean_column(df.iloc[:, j], categorical) for j in range(df.shape[1])},
+                               index=df.index)
+        cleaned.columns = df.columns
+        return cleaned
+
+    cleaned = df.copy(deep=False)
+    for field in fields:
+        cleaned[field] = clean_column(df[field], categorical)
+    return cleaned
+
+def stable_cluster_id(record_ids):
+    """Derives a cluster id from the smallest member id of a cluster, so that
+        it does not depend on the order clusters are produced in. The id is a
+        non-negative 63 bit integer.
+    """
+    key = str(min(record_ids)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') >> 1
+
+
+def record_digest(record, fields=None):
+    """A stable 16 byte digest of a record, or of the given fields of a
+        record only.
+    """
+    values = record if fields is None else tuple(record.get(field) for field in fields)
+    return hashlib.blake2b(pickle.dumps(values, protocol=4), digest_size=16).digest()
+
+
+def settings_digest(settings_file):
+    """The hex digest of a settings file, to tell whether state stored next to
+        it was built with the same model.
+    """
+    hasher = hashlib.sha256()
+    with open(settings_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def static_predicates(fingerprinter):
+    """The positions of the predicates of a fingerprinter whose block keys only
+        depend on the record itself. Predicates with a part that uses an index
+        of the data depend on the other records too.
+    """
+    return [i for i, predicate in enumerate(fingerprinter.predicates)
+            if not any(hasattr(part, 'index') for part in predicate)]
+
+
+def cleanup_scores(scores):
+    """Removes the file backing scores that dedupe memory-mapped to disk."""
+    filename = getattr(scores, 'filename', None)
+    if filename:
+        scores._mmap.close()
+        os.remove(filename)
+
 
 def select_fields(fields, field_properties):
     for i in field_properties:
@@ -34,32 +148,72 @@ def select_fields(fields, field_properties):
                 fields.append({'field': i[0], 'type': i[1], 'crf': True})
             else:
                 raise Exception(i[2] + " is not a valid field property")
-                
+
+
+def field_names(field_properties):
+    return [i if type(i)==str else i[0] for i in field_properties]
+
+
+def model_field_properties(model):
+    """The (field, type) pairs of the variables of a trained model, as
+        field_properties for clean_punctuation and specify_type.
+    """
+    return [(variable.field, variable.type) for variable in model.data_model.primary_variables]
+
     
 def latlong_datatype(x):
     if x is None:
         return None
+    match = LATLONG.fullmatch(str(x))
+    if match is not None:
+        return float(match.group(2)), float(match.group(3))
+    try:
+        lat, lon = literal_eval(x)
+        return float(lat), float(lon)
+    except Exception:
+        raise Exception(LATLONG_ERROR)
+
+
+def latlong_column(column):
+    """Parse a column of '(lat, lon)' strings into (float, float) tuples.
+        The distinct values are joined into one string and matched in a
+        single regex pass. If some value is not a plain pair of numbers, e.g.
+        "('1.5', '2.5')" or '[1, 2]', every distinct value is parsed on its
+        own, falling back to literal_eval. Missing values stay None.
+    """
+    codes, uniques = pd.factorize(column)
+    text = '\n'.join(str(x) for x in uniques)
+    matches = LATLONG.findall(text)
+    if len(matches) == len(uniques) and text.count('\n') == max(len(uniques) - 1, 0):
+        coordinates = np.array([match[1:] for match in matches], dtype=float).reshape(-1, 2)
+        parsed = pd.Series(list(zip(coordinates[:, 0].tolist(), coordinates[:, 1].tolist())), dtype=object)
     else:
-        try:
-            x = literal_eval(x)
-            k,v = x
-            k = float(k)
-            v = float(v)
-            return k, v
-        except:
-            raise Exception("Make sure that LatLong columns are tuples arranged like ('lat', 'lon')")
-            
-            
+        parsed = pd.Series([latlong_datatype(x) for x in uniques], dtype=object)
+    return pd.Series(_take_with_missing(parsed.to_numpy(), codes), index=column.index, name=column.name)
+
+
+def price_column(column):
+    """Convert a column of numbers written with thousands separators to
+        floats in one pass over its distinct values. Missing values become
+        None, in which case the column is of object dtype.
+    """
+    codes, uniques = pd.factorize(column)
+    try:
+        prices = pd.Series(uniques, dtype=object).astype(str).str.replace(',', '', regex=False).to_numpy(dtype=float)
+    except ValueError:
+        raise Exception('Make sure that Price columns can be converted to float.')
+
+    parsed = _take_with_missing(prices, codes, np.nan)
+    missing = np.isnan(parsed)
+    if missing.any():
+        parsed = parsed.astype(object)
+        parsed[missing] = None
+    return pd.Series(parsed, index=column.index, name=column.name)
+
+
 def specify_type(df, field_properties):
     for i in field_properties:
         if i[1] == 'LatLong':
-            df[i[0]] = df[i[0]].apply(lambda x: latlong_datatype(x))
+            df[i[0]] = latlong_column(df[i[0]])
         elif i[1] == 'Price':
-            try:
-                df[i[0]] = df[i[0]].str.replace(",","")
-                df[i[0]] = df[i[0]].replace({None: np.nan})
-                df[i[0]] = df[i[0]].astype(float)
-                df[i[0]] = df[i[0]].replace({np.nan: None})
-            except:
-                raise Exception('Make sure that Price columns can be converted to float.')
- 
+            df[i[0]] = price_column(df[i[0]])
@@ -19,6 +19,8 @@ setup(name='pandas_dedupe',
           'dedupe>=2.0.0',
           'unidecode',
           'pandas',
+          'scikit-learn',
+          'scipy',
       ],
       zip_safe=False,
       
@@ -0,0 +1,51 @@
+import pickle
+import shutil
+
+import pytest
+from dedupe import predicate_functions
+from dedupe.predicates import SimplePredicate, StringPredicate
+
+from benchmarks.settings import config_name as benchmark_config_name
+
+
+# Predicates that use no index, added to the index-only blocking of the
+# benchmark models so that persisted and cached block keys are exercised
+STATIC_PREDICATES = {
+    ('dedupe', 'mixed'): (StringPredicate(predicate_functions.sameThreeCharStartPredicate, 'last_name'),
+                          SimplePredicate(predicate_functions.latLongGridPredicate, 'loc') +
+                          StringPredicate(predicate_functions.firstTokenPredicate, 'first_name')),
+    ('gazetteer', 'fullname'): (StringPredicate(predicate_functions.sameThreeCharStartPredicate, 'fullname'),),
+}
+
+
+@pytest.fixture
+def model_config(tmp_path):
+    """Copies the settings file of a benchmark model into tmp_path, so the
+        state files written next to it stay there, and returns a function
+        giving the config_name of the copy.
+    """
+    def copy(pipeline, profile):
+        name = '%s_%s' % (pipeline, profile)
+        shutil.copy(benchmark_config_name(pipeline, profile) + '_learned_settings',
+                    tmp_path / (name + '_learned_settings'))
+        return str(tmp_path / name)
+    return copy
+
+
+@pytest.fixture
+def static_model_config(model_config):
+    """Like model_config, but the blocking of the copied model also holds the
+        STATIC_PREDICATES of its pipeline and profile.
+    """
+    def copy(pipeline, profile):
+        config_name = model_config(pipeline, profile)
+        settings_file = config_name + '_learned_settings'
+        with open(settings_file, 'rb') as f:
+            data_model, classifier, predicates = pickle.load(f), pickle.load(f), pickle.load(f)
+
+        with open(settings_file, 'wb') as f:
+            pickle.dump(data_model, f)
+            pickle.dump(classifier, f)
+            pickle.dump(tuple(predicates) + STATIC_PREDICATES[pipeline, profile], f)
+        return config_name
+    return copy
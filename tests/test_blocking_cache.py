@@ -0,0 +1,62 @@
+import re
+
+import pytest
+
+from pandas_dedupe import dedupe_dataframe
+from pandas_dedupe.blocking_cache import _load_cache
+from pandas_dedupe.utility_functions import settings_digest
+
+from benchmarks.generators import PROFILES, dedupe_frame
+
+
+FIELDS = PROFILES['mixed']
+COLUMNS = ['first_name', 'last_name', 'city', 'salary', 'loc']
+
+
+def _cache(config_name):
+    return _load_cache(config_name + '_blocking_keys.npz', settings_digest(config_name + '_learned_settings'))
+
+
+def _hits(output):
+    hits, records = re.search(r'# cached blocking keys (\d+) of (\d+) records', output).groups()
+    return int(hits), int(records)
+
+
+def test_partial_run_keeps_cached_records(static_model_config):
+    config_name = static_model_config('dedupe', 'mixed')
+    df = dedupe_frame(1500, 0.3, seed=1)[COLUMNS]
+
+    dedupe_dataframe(df.iloc[:1200], FIELDS, config_name=config_name, cache_blocks=True)
+    cached = _cache(config_name)
+    assert cached and all(cached.values())
+
+    dedupe_dataframe(df, FIELDS, config_name=config_name, cache_blocks=True, n_shards=2)
+    merged = _cache(config_name)
+    assert len(merged) > len(cached)
+    assert all(merged[record_hash] == keys for record_hash, keys in cached.items())
+
+    # A run over part of the records does not drop the others
+    dedupe_dataframe(df.iloc[:300], FIELDS, config_name=config_name, cache_blocks=True)
+    assert _cache(config_name) == merged
+
+
+def test_cached_run_matches_fresh_run(static_model_config, capsys):
+    config_name = static_model_config('dedupe', 'mixed')
+    df = dedupe_frame(1000, 0.3, seed=2)[COLUMNS]
+
+    fresh = dedupe_dataframe(df, FIELDS, config_name=config_name)
+    dedupe_dataframe(df, FIELDS, config_name=config_name, cache_blocks=True)
+    assert all(_cache(config_name).values())
+
+    capsys.readouterr()
+    cached = dedupe_dataframe(df, FIELDS, config_name=config_name, cache_blocks=True)
+    hits, records = _hits(capsys.readouterr().out)
+    assert hits == records > 0
+    assert (cached['cluster id'] == fresh['cluster id']).all()
+
+
+def test_cache_blocks_rejects_incremental(model_config):
+    with pytest.raises(ValueError):
+        dedupe_dataframe(dedupe_frame(100, 0.3, seed=3)[COLUMNS], FIELDS,
+                         config_name=model_config('dedupe', 'mixed'),
+                         cache_blocks=True, incremental=True)
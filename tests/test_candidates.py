@@ -0,0 +1,50 @@
+from pandas_dedupe.candidates import NgramIndex
+
+from benchmarks.generators import linked_frames
+
+
+def _gazette(n, seed):
+    clean, messy = linked_frames(n, 0.5, seed=seed)
+    return ({record_id: {'fullname': value} for record_id, value in zip(clean.index, clean['fullname'])},
+            messy['fullname'].tolist())
+
+
+def test_chunked_query_matches_single_chunk():
+    records, values = _gazette(2000, seed=1)
+    whole = NgramIndex(chunk_size=len(records)).fit(records, 'fullname')
+    chunked = NgramIndex(chunk_size=300, batch_size=128).fit(records, 'fullname')
+
+    expected = list(whole.query(values, 10))
+    assert list(chunked.query(values, 10)) == expected
+    assert all(len(candidates) == 10 for candidates in expected)
+
+
+def test_common_ngrams_are_not_indexed():
+    records, _ = _gazette(2000, seed=2)
+    index = NgramIndex().fit(records, 'fullname')
+    unpruned = NgramIndex(max_df=1.0).fit(records, 'fullname')
+    assert index._matrix.nnz < unpruned._matrix.nnz
+
+    # A fraction of a tiny gazette rounding to zero records is still valid
+    small = dict(list(records.items())[:3])
+    assert len(NgramIndex().fit(small, 'fullname')) == 3
+
+
+def test_add_and_remove_match_fitted_index():
+    records, values = _gazette(1000, seed=3)
+    ids = list(records)
+    index = NgramIndex(chunk_size=250).fit(records, 'fullname')
+
+    removed = ids[::3]
+    index.remove(removed)
+    index.add({record_id: records[record_id] for record_id in removed[:50]})
+    kept = set(ids) - set(removed[50:])
+
+    assert len(index) == len(kept)
+    for candidates in index.query(values, 10):
+        assert set(candidates) <= kept
+
+    # Every record is its own best candidate, wherever it sits in the index
+    lookup = [records[record_id]['fullname'] for record_id in removed[:50]]
+    best = [candidates[0] for candidates in index.query(lookup, 1)]
+    assert [records[record_id]['fullname'] for record_id in best] == lookup
@@ -0,0 +1,63 @@
+import warnings
+
+import dedupe
+import numpy as np
+import pandas as pd
+
+from pandas_dedupe import dedupe_dataframe
+from pandas_dedupe.dedupe_dataframe import _canonical_records, _cluster_results, _stringify
+
+from benchmarks.generators import PROFILES, dedupe_frame
+
+
+def test_cluster_results_index_keeps_record_id_dtype():
+    clustered_dupes = [((np.int64(3), np.int64(7)), np.array([0.9, 0.8])),
+                       ((np.int64(5),), np.array([1.0]))]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = _cluster_results({}, clustered_dupes, False)
+
+    assert results.index.name == 'Id'
+    assert results.index.dtype == np.int64
+    assert results.index.tolist() == [3, 7, 5]
+    assert results.loc[3, 'cluster id'] == results.loc[7, 'cluster id'] != results.loc[5, 'cluster id']
+
+
+def test_singleton_canonical_records_match_dedupe_canonicalize():
+    data = {1: {'name': 'ann', 'city': '', 'salary': 1200.5, 'loc': (41.9, 12.5)},
+            2: {'name': None, 'city': 'rome', 'salary': None, 'loc': None},
+            3: {'name': '', 'city': None, 'salary': 0.0, 'loc': (0.0, 0.0)},
+            4: {'name': 'bob', 'city': 'oslo', 'salary': 10.0, 'loc': (59.9, 10.7)},
+            5: {'name': 'bob', 'city': None, 'salary': 10.0, 'loc': (59.9, 10.7)}}
+    clustered_dupes = [((1,), np.array([1.0])), ((2,), np.array([1.0])), ((3,), np.array([1.0])),
+                       ((4, 5), np.array([0.9, 0.9]))]
+    cluster_ids = np.array([10, 20, 30, 40])
+    fields = ['name', 'city', 'salary', 'loc']
+
+    expected = pd.DataFrame([dedupe.canonicalize([_stringify(data[i], fields) for i in id_set])
+                             for id_set, _ in clustered_dupes],
+                            columns=fields, index=pd.Index(cluster_ids, name='cluster id'))
+    for canonicalize in (True, ['loc', 'name']):
+        canonical_df = _canonical_records(data, clustered_dupes, cluster_ids, canonicalize, n_cores=0)
+        columns = fields if canonicalize is True else canonicalize
+        pd.testing.assert_frame_equal(canonical_df, expected[columns].add_prefix('canonical_'))
+
+
+def test_collapse_duplicates_keeps_the_cluster_ids(model_config):
+    config_name = model_config('dedupe', 'mixed')
+    df = dedupe_frame(1500, 0.3, seed=1)[['first_name', 'last_name', 'city', 'salary', 'loc']]
+    copies = df.iloc[::5].copy()
+    copies.index = copies.index + 10000
+    df = pd.concat([df, copies]).sample(frac=1, random_state=0)
+
+    expected = dedupe_dataframe(df, PROFILES['mixed'], config_name=config_name, n_cores=0)
+    collapsed = dedupe_dataframe(df, PROFILES['mixed'], config_name=config_name, n_cores=0,
+                                 collapse_duplicates=True)
+
+    pd.testing.assert_frame_equal(collapsed.drop(columns='confidence'), expected.drop(columns='confidence'))
+    # The later of two identical rows is added to the cluster of the first
+    copy_first = df.index.get_indexer(copies.index) < df.index.get_indexer(copies.index - 10000)
+    later = copies.index.where(~copy_first, copies.index - 10000)
+    assert (collapsed.loc[later, 'confidence'] == 1.0).all()
+    assert (collapsed.loc[copies.index, 'cluster id'].to_numpy()
+            == collapsed.loc[copies.index - 10000, 'cluster id'].to_numpy()).all()
@@ -0,0 +1,145 @@
+import os
+import sys
+import sqlite3
+import subprocess
+
+import pandas as pd
+
+from pandas_dedupe import GazetteerSession, gazetteer_dataframe
+from pandas_dedupe import gazette_index
+
+from benchmarks.generators import linked_frames
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs gazetteer_dataframe with a persisted index in a process of its own
+SEARCH = """
+import sys
+import pandas as pd
+from pandas_dedupe import gazetteer_dataframe
+
+clean, messy = pd.read_pickle(sys.argv[1]), pd.read_pickle(sys.argv[2])
+results = gazetteer_dataframe(clean, messy, 'fullname', config_name=sys.argv[3], cache_index=True, n_cores=0)
+results.to_pickle(sys.argv[4])
+"""
+
+
+def _frames():
+    clean, messy = linked_frames(1000, 0.5, seed=1)
+    return clean[['fullname']], messy[['fullname']]
+
+
+def _shared_frames():
+    """Adds a copy of each of the first 100 gazette records, so that the
+        values of those records are also held by other records.
+    """
+    clean, messy = _frames()
+    copies = clean.iloc[:100].copy()
+    copies.index = copies.index + 10000
+    return pd.concat([clean, copies]), messy
+
+
+def _persisted_keys(config_name):
+    con = sqlite3.connect(config_name + '_gazette_index.db')
+    try:
+        return con.execute("SELECT record_id, block_key FROM indexed_records").fetchall()
+    finally:
+        con.close()
+
+
+def _search_in_process(tmp_path, config_name, output):
+    clean, messy = _frames()
+    clean.to_pickle(tmp_path / 'clean.pkl')
+    messy.to_pickle(tmp_path / 'messy.pkl')
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    completed = subprocess.run([sys.executable, '-c', SEARCH, str(tmp_path / 'clean.pkl'),
+                                str(tmp_path / 'messy.pkl'), config_name, str(output)],
+                               env=env, capture_output=True, text=True, check=True)
+    return completed.stdout, pd.read_pickle(output)
+
+
+def assert_same_matches(results, expected):
+    pd.testing.assert_series_equal(results['cluster id'], expected['cluster id'], check_dtype=False)
+    pd.testing.assert_series_equal(results['confidence'], expected['confidence'], check_dtype=False)
+
+
+def test_persisted_index_reloads_in_a_new_process(static_model_config, tmp_path):
+    config_name = static_model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+    expected = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, n_cores=0)
+    assert expected['cluster id'].notna().sum() > 0
+
+    stdout, saved = _search_in_process(tmp_path, config_name, tmp_path / 'saved.pkl')
+    assert 'Reading gazette index' not in stdout
+
+    # Only the keys of the static predicate, the second of the model, are kept
+    persisted = _persisted_keys(config_name)
+    assert {record_id for record_id, _ in persisted} == set(clean.index)
+    assert all(block_key.endswith(':1') for _, block_key in persisted)
+
+    stdout, loaded = _search_in_process(tmp_path, config_name, tmp_path / 'loaded.pkl')
+    assert 'Reading gazette index' in stdout
+
+    assert_same_matches(saved, expected)
+    assert_same_matches(loaded, expected)
+
+
+def test_persisted_index_is_rebuilt_for_another_gazette(static_model_config, tmp_path):
+    config_name = static_model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+    gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, cache_index=True, n_cores=0)
+
+    smaller = clean.iloc[:-100]
+    expected = gazetteer_dataframe(smaller, messy, 'fullname', config_name=config_name, n_cores=0)
+    results = gazetteer_dataframe(smaller, messy, 'fullname', config_name=config_name, cache_index=True,
+                                  n_cores=0)
+    assert_same_matches(results, expected)
+    assert {record_id for record_id, _ in _persisted_keys(config_name)} == set(smaller.index)
+
+
+def test_gazette_updates_are_persisted_incrementally(static_model_config, monkeypatch, capsys):
+    config_name = static_model_config('gazetteer', 'fullname')
+    clean, messy = _shared_frames()
+    session = GazetteerSession(clean.iloc[:-100], 'fullname', config_name=config_name, cache_index=True)
+
+    def rewrite(*args):
+        raise AssertionError('the persisted index was rewritten')
+
+    # Updates write the changed records only, never the whole index
+    monkeypatch.setattr(gazette_index, '_save_index', rewrite)
+    monkeypatch.setattr(gazette_index, '_copy_database', rewrite)
+    session.add(clean.iloc[-100:])
+    session.remove(clean.index[:50])
+    monkeypatch.undo()
+
+    updated = clean.iloc[50:]
+    persisted = _persisted_keys(config_name)
+    assert {record_id for record_id, _ in persisted} == set(updated.index)
+
+    expected = gazetteer_dataframe(updated, messy, 'fullname', config_name=config_name, n_cores=0)
+    assert_same_matches(session.search(messy), expected)
+
+    capsys.readouterr()
+    reloaded = GazetteerSession(updated.sample(frac=1, random_state=0), 'fullname', config_name=config_name,
+                                cache_index=True)
+    assert 'Reading gazette index' in capsys.readouterr().out
+    assert_same_matches(reloaded.search(messy), expected)
+
+
+def test_updates_of_shared_values_match_a_new_session(static_model_config):
+    config_name = static_model_config('gazetteer', 'fullname')
+    clean, messy = _shared_frames()
+    session = GazetteerSession(clean, 'fullname', config_name=config_name, n_cores=0)
+
+    # The values of removed and replaced records are still held by their copies
+    removed = clean.index[:50]
+    replaced = clean.iloc[50:100].copy()
+    replaced['fullname'] = clean['fullname'].iloc[200:250].to_numpy()
+    session.remove(removed)
+    session.add(replaced)
+
+    updated = pd.concat([clean.drop(index=removed).drop(index=replaced.index), replaced])
+    fresh = GazetteerSession(updated, 'fullname', config_name=config_name, n_cores=0)
+    assert_same_matches(session.search(messy), fresh.search(messy))
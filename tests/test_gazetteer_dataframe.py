@@ -0,0 +1,94 @@
+import dedupe
+import pandas as pd
+import pytest
+
+from pandas_dedupe import gazetteer_dataframe
+from pandas_dedupe.gazetteer_dataframe import _prepare_gazette, _prepare_messy
+from pandas_dedupe.records import records_from_dataframe
+
+from benchmarks.generators import linked_frames
+
+
+def _frames():
+    """A gazette holding a copy of each of its first 100 records, so that
+        some messy records have several matches of the same confidence.
+    """
+    clean, messy = linked_frames(1000, 0.5, seed=1)
+    clean, messy = clean[['fullname']], messy[['fullname']]
+    copies = clean.iloc[:100].copy()
+    copies.index = copies.index + 10000
+    return pd.concat([clean, copies]), messy
+
+
+def _baseline_match_results(clustered_dupes, canonical_df=None):
+    # _match_results of pandas_dedupe 1.5.0, given every match of a record
+    df_data = []
+    for messy_id, matches in clustered_dupes:
+        for canon_id, scores in matches:
+            df_data.append({'cluster id': canon_id, 'confidence': scores, 'record id': messy_id})
+
+    clustered_df = pd.DataFrame(df_data, columns=['cluster id', 'confidence', 'record id'])
+    if canonical_df is not None:
+        clustered_df = (clustered_df.set_index('cluster id', drop=False)
+                        .join(canonical_df, how='left').set_index('record id'))
+    else:
+        clustered_df = clustered_df.set_index('record id')
+
+    confidence_maxes = clustered_df.groupby([clustered_df.index])['confidence'].transform(max)
+    clustered_df = clustered_df.loc[clustered_df['confidence'] == confidence_maxes]
+    return clustered_df.loc[~clustered_df.index.duplicated(keep='first')]
+
+
+def _baseline_search(config_name, clean, messy, threshold, canonicalize):
+    common_name, df_canonical = _prepare_gazette(clean, 'fullname')
+    with open(config_name + '_learned_settings', 'rb') as f:
+        deduper = dedupe.StaticGazetteer(f, num_cores=0)
+    deduper.index(records_from_dataframe(df_canonical, [common_name]))
+    clustered_dupes = deduper.search(_prepare_messy(messy, 'fullname', common_name), threshold,
+                                     n_matches=None, generator=False)
+    canonical_df = df_canonical.add_prefix('canonical_') if canonicalize else None
+    return messy.join(_baseline_match_results(clustered_dupes, canonical_df), how='left')
+
+
+@pytest.mark.parametrize('threshold', [0, 0.5])
+def test_best_matches_match_every_match_search(model_config, threshold):
+    config_name = model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+
+    results = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, threshold=threshold,
+                                  n_cores=0)
+    expected = _baseline_search(config_name, clean, messy, threshold, False)
+    assert results['cluster id'].isin(clean.index[:100] + 10000).any()
+    pd.testing.assert_frame_equal(results, expected, check_dtype=False)
+
+    # Intended difference: the baseline joined the canonical columns before
+    # taking the best match, which reordered tied matches by gazette id. The
+    # best match no longer depends on canonicalize.
+    canonical = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, threshold=threshold,
+                                    n_cores=0, canonicalize=True)
+    pd.testing.assert_frame_equal(canonical[results.columns], results)
+    matched = canonical['cluster id'].notnull()
+    assert (canonical.loc[matched, 'canonical_fullname'].to_numpy()
+            == clean['fullname'].str.lower().loc[canonical.loc[matched, 'cluster id']].to_numpy()).all()
+
+    baseline = _baseline_search(config_name, clean, messy, threshold, True)
+    ties = baseline['cluster id'].fillna(-1) != canonical['cluster id'].fillna(-1)
+    assert ties.any()
+    assert (baseline.loc[ties, 'cluster id'] + 10000 == canonical.loc[ties, 'cluster id']).all()
+    pd.testing.assert_frame_equal(canonical[~ties], baseline[~ties], check_dtype=False)
+    pd.testing.assert_series_equal(canonical['confidence'], baseline['confidence'], check_dtype=False)
+
+
+def test_n_matches_keeps_the_best_matches_first(model_config):
+    config_name = model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+
+    best = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, n_cores=0)
+    results = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, n_cores=0, n_matches=2)
+
+    matched = results.dropna(subset=['cluster id'])
+    counts = matched.groupby(level=0).size()
+    assert counts.max() == 2 and counts.min() >= 1
+    assert (matched.groupby(level=0)['confidence'].diff().dropna() <= 0).all()
+    first = matched[~matched.index.duplicated(keep='first')]
+    pd.testing.assert_frame_equal(first, best.dropna(subset=['cluster id']))
@@ -0,0 +1,82 @@
+import dedupe
+
+from pandas_dedupe import dedupe_dataframe
+from pandas_dedupe import incremental as incremental_module
+from pandas_dedupe.incremental import _candidate_pairs, _connect, _find_changes, cluster_incremental
+from pandas_dedupe.instrumentation import PipelineStats
+from pandas_dedupe.dedupe_dataframe import _prepare
+from pandas_dedupe.utility_functions import settings_digest, static_predicates
+
+from benchmarks.generators import PROFILES, dedupe_frame
+
+
+FIELDS = PROFILES['mixed']
+COLUMNS = ['first_name', 'last_name', 'city', 'salary', 'loc']
+
+
+def _records(df):
+    _, data, _, _ = _prepare(df[COLUMNS], FIELDS, False, False, False, PipelineStats())
+    return data
+
+
+def _pairs(pairs):
+    return {(a, b) for (a, _), (b, _) in pairs}
+
+
+def test_incremental_pairs_match_full_run(static_model_config, tmp_path, monkeypatch):
+    settings_file = static_model_config('dedupe', 'mixed') + '_learned_settings'
+    with open(settings_file, 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=0)
+    static = set(static_predicates(deduper.fingerprinter))
+    static_keys = [(i, predicate) for i, predicate in enumerate(deduper.fingerprinter.predicates) if i in static]
+    assert static
+
+    data = _records(dedupe_frame(3000, 0.3, seed=1))
+    old = {record_id: data[record_id] for record_id in list(data)[:2700]}
+
+    state_file = str(tmp_path / 'state.db')
+    cluster_incremental(deduper, old, 0.4, settings_file, state_file)
+
+    # Only the keys of the static predicates are stored
+    con = _connect(state_file, settings_digest(settings_file))
+    stored = set(con.execute("SELECT block_key, record_id FROM blocking_map"))
+    assert stored and stored == set(incremental_module._block_keys(old.items(), static_keys))
+
+    new = _find_changes(con, data)
+    assert set(new) == set(list(data)[2700:])
+
+    # The static predicates are evaluated on the new records only, the
+    # stored keys stand in for the unchanged ones
+    blocked = []
+    block_keys = incremental_module._block_keys
+
+    def recording(records, predicates):
+        records = list(records)
+        if any(i in static for i, _ in predicates):
+            blocked.extend(record_id for record_id, _ in records)
+        return block_keys(records, predicates)
+
+    monkeypatch.setattr(incremental_module, '_block_keys', recording)
+    incremental = _pairs(_candidate_pairs(con, deduper, data, new))
+    assert set(blocked) == set(new)
+
+    full = {(a, b) for a, b in _pairs(deduper.pairs(data)) if a in new or b in new}
+    assert full
+    assert incremental == full
+
+
+def test_incremental_run_joins_existing_clusters(static_model_config):
+    config_name = static_model_config('dedupe', 'mixed')
+    df = dedupe_frame(3000, 0.3, seed=1)
+
+    dedupe_dataframe(df[COLUMNS].iloc[:2700], FIELDS, config_name=config_name, incremental=True, n_cores=0)
+    incremental = dedupe_dataframe(df[COLUMNS], FIELDS, config_name=config_name, incremental=True, n_cores=0)
+    full = dedupe_dataframe(df[COLUMNS], FIELDS, config_name=config_name, n_cores=0)
+
+    def joined(results):
+        # New rows clustered with at least one row of the first run
+        old_clusters = set(results['cluster id'].iloc[:2700])
+        return int(results['cluster id'].iloc[2700:].isin(old_clusters).sum())
+
+    assert joined(full) > 0
+    assert joined(incremental) >= 0.9 * joined(full)
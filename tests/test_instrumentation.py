@@ -0,0 +1,68 @@
+import dedupe
+import numpy as np
+import pytest
+
+from pandas_dedupe import dedupe_dataframe, instrumentation
+from pandas_dedupe.instrumentation import PipelineStats
+
+from benchmarks.generators import PROFILES, dedupe_frame
+from benchmarks.settings import config_name
+
+
+def _allocate(n_bytes):
+    block = np.ones(n_bytes, dtype=np.uint8)
+    return int(block[::4096].sum())
+
+
+@pytest.mark.skipif(not instrumentation._reset_peak_rss(), reason='the peak RSS cannot be reset')
+def test_peak_rss_covers_each_stage():
+    stats = PipelineStats()
+    with stats.stage('outer'):
+        with stats.stage('large'):
+            _allocate(200 * 2**20)
+        with stats.stage('small'):
+            pass
+    peaks = {record['stage']: record['peak_rss'] for record in stats.stages}
+
+    assert peaks['large'] - peaks['small'] > 150 * 2**20
+    # The outer stage keeps the peak of the stages nested in it
+    assert peaks['outer'] >= peaks['large']
+
+
+def test_peak_rss_falls_back_to_process_peak(monkeypatch):
+    monkeypatch.setattr(instrumentation, '_reset_peak_rss', lambda: False)
+    stats = PipelineStats()
+    with stats.stage('stage'):
+        pass
+    assert 'peak_rss' not in stats.stages[0]
+    assert stats.stages[0]['process_peak_rss'] > 0
+
+
+def test_count_pairs_restores_score():
+    with open(config_name('dedupe', 'mixed') + '_learned_settings', 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=0)
+    stats = PipelineStats()
+    record = {}
+
+    with pytest.raises(RuntimeError):
+        with stats.count_pairs(deduper, record):
+            raise RuntimeError()
+    assert 'score' not in vars(deduper)
+
+    # An instance attribute already wrapping score is put back
+    def score(pairs):
+        return []
+    deduper.score = score
+    with stats.count_pairs(deduper, record):
+        assert deduper.score is not score
+    assert deduper.score is score
+
+
+def test_runs_without_stats_leave_the_peak_rss_alone(model_config, monkeypatch):
+    def reset():
+        raise AssertionError('the peak RSS was reset')
+
+    monkeypatch.setattr(instrumentation, '_reset_peak_rss', reset)
+    df = dedupe_frame(300, 0.3, seed=1)[['first_name', 'last_name', 'city', 'salary', 'loc']]
+    results = dedupe_dataframe(df, PROFILES['mixed'], config_name=model_config('dedupe', 'mixed'), n_cores=0)
+    assert len(results) == len(df)
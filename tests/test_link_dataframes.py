@@ -0,0 +1,59 @@
+import dedupe
+import pandas as pd
+import pytest
+
+from pandas_dedupe import link_dataframes
+from pandas_dedupe.link_dataframes import _prepare
+from pandas_dedupe.out_of_core import join_on_disk
+
+from benchmarks.generators import PROFILES, linked_frames
+
+
+FIELDS = PROFILES['mixed']
+COLUMNS = ['first_name', 'last_name', 'city', 'salary', 'loc']
+
+
+def _frames():
+    clean, messy = linked_frames(1000, 0.5, seed=1)
+    return clean[COLUMNS], messy[COLUMNS]
+
+
+@pytest.mark.parametrize('threshold', [0, 0.5])
+def test_join_on_disk_matches_join(model_config, threshold):
+    clean, messy = _frames()
+    _, _, data_1 = _prepare(clean, FIELDS, 'dfa')
+    _, _, data_2 = _prepare(messy, FIELDS, 'dfb')
+    with open(model_config('link', 'mixed') + '_learned_settings', 'rb') as sf:
+        linker = dedupe.StaticRecordLink(sf, num_cores=0)
+
+    expected = linker.join(data_1, data_2, threshold)
+    # A small chunksize, so the scores are spilled in several chunks
+    links = join_on_disk(linker, data_1, data_2, threshold, chunksize=1000)
+
+    assert len(expected) > 0
+    assert sorted(links) == sorted((pair, float(score)) for pair, score in expected)
+
+
+def test_link_on_disk_and_link_table_match_link_dataframes(model_config):
+    config_name = model_config('link', 'mixed')
+    clean, messy = _frames()
+
+    expected = link_dataframes(clean, messy, FIELDS, config_name=config_name, n_cores=0, threshold=0.5)
+    on_disk = link_dataframes(clean, messy, FIELDS, config_name=config_name, n_cores=0, threshold=0.5,
+                              on_disk=True)
+    pd.testing.assert_frame_equal(on_disk, expected)
+
+    table = link_dataframes(clean, messy, FIELDS, config_name=config_name, n_cores=0, threshold=0.5,
+                            link_table=True)
+    assert list(table.columns) == ['dfa id', 'dfb id', 'confidence', 'cluster id']
+    assert len(table) == expected['cluster id'].count() // 2 > 0
+    assert table['dfa id'].is_unique and table['dfb id'].is_unique
+    assert table['dfa id'].isin(clean.index).all() and table['dfb id'].isin(messy.index).all()
+
+    # The linked rows of dfa and dfb carry the cluster id and confidence of their link
+    linked = expected.dropna(subset=['cluster id'])
+    linked_a, linked_b = linked.iloc[::2], linked.iloc[1::2]
+    assert sorted(table['cluster id']) == sorted(linked_a['cluster id']) == sorted(linked_b['cluster id'])
+    by_cluster = table.set_index('cluster id')
+    assert (by_cluster.loc[linked_a['cluster id'], 'confidence'].to_numpy()
+            == linked_a['confidence'].to_numpy()).all()
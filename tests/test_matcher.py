@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import subprocess
+
+from pandas_dedupe import GazetteerMatcher, gazetteer_dataframe
+
+from benchmarks.generators import linked_frames
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Builds a matcher with a persisted index in a process of its own
+MATCH = """
+import sys
+import json
+import pandas as pd
+from pandas_dedupe import GazetteerMatcher
+
+clean, messy = pd.read_pickle(sys.argv[1]), pd.read_pickle(sys.argv[2])
+matcher = GazetteerMatcher(clean, 'fullname', config_name=sys.argv[3], cache_index=True)
+print(json.dumps(matcher.match_many(messy.to_dict('records')), default=int))
+"""
+
+
+def _frames():
+    clean, messy = linked_frames(1000, 0.5, seed=2)
+    return clean[['fullname']], messy[['fullname']]
+
+
+def _cluster_ids(matches):
+    return [record[0]['cluster id'] if record else None for record in matches]
+
+
+def test_match_many_agrees_with_gazetteer_dataframe(model_config):
+    config_name = model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+
+    expected = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, n_cores=0)
+    matcher = GazetteerMatcher(clean, 'fullname', config_name=config_name)
+    matches = matcher.match_many(messy.to_dict('records'))
+
+    assert _cluster_ids(matches) == [None if cluster_id != cluster_id else cluster_id
+                                     for cluster_id in expected['cluster id']]
+    assert matcher.match(messy.iloc[0].to_dict()) == matches[0]
+
+
+def test_persisted_index_warm_starts_a_matcher_in_a_new_process(model_config, tmp_path):
+    config_name = model_config('gazetteer', 'fullname')
+    clean, messy = _frames()
+    clean.to_pickle(tmp_path / 'clean.pkl')
+    messy.to_pickle(tmp_path / 'messy.pkl')
+
+    expected = GazetteerMatcher(clean, 'fullname', config_name=config_name).match_many(messy.to_dict('records'))
+    assert any(expected)
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    runs = []
+    for _ in range(2):
+        completed = subprocess.run([sys.executable, '-c', MATCH, str(tmp_path / 'clean.pkl'),
+                                    str(tmp_path / 'messy.pkl'), config_name],
+                                   env=env, capture_output=True, text=True, check=True)
+        runs.append(completed.stdout)
+
+    assert 'Reading gazette index' not in runs[0]
+    assert 'Reading gazette index' in runs[1]
+    for stdout in runs:
+        matches = json.loads(stdout.strip().splitlines()[-1])
+        assert _cluster_ids(matches) == _cluster_ids(expected)
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from pandas_dedupe.records import RecordMapping, records_from_dataframe
+
+
+def _frame():
+    df = pd.DataFrame({'name': ['ann', 'bob', None, 'ann'],
+                       'city': pd.Categorical(['rome', None, 'oslo', 'rome']),
+                       'age': [31.0, 40.0, None, 31.0]},
+                      index=[10, 3, 7, 12])
+    return df.astype({'age': object}).where(df.notnull(), None)
+
+
+def test_lazy_mapping_matches_dictionary():
+    df = _frame()
+    for index in (None, 'dfa' + df.index.astype(str)):
+        records = records_from_dataframe(df, ['name', 'city', 'age'], index=index)
+        lazy = records_from_dataframe(df, ['name', 'city', 'age'], lazy=True, index=index)
+
+        assert isinstance(lazy, RecordMapping)
+        assert lazy == records
+        assert list(lazy) == list(records)
+        assert list(lazy.items()) == list(records.items())
+        assert list(lazy.values()) == list(records.values())
+        assert next(iter(lazy)) in lazy
+        assert 'missing' not in lazy and [1] not in lazy
+
+
+def test_lazy_mapping_falls_back_on_duplicate_ids():
+    df = _frame()
+    df.index = [1, 2, 2, 3]
+    records = records_from_dataframe(df, ['name'], lazy=True)
+    assert records == {1: {'name': 'ann'}, 2: {'name': None}, 3: {'name': 'ann'}}
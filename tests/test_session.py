@@ -0,0 +1,61 @@
+import pandas as pd
+
+from pandas_dedupe import (DedupeSession, GazetteerSession, LinkSession, dedupe_dataframe,
+                           gazetteer_dataframe, link_dataframes)
+
+from benchmarks.generators import PROFILES, dedupe_frame, linked_frames
+
+
+FIELDS = PROFILES['mixed']
+COLUMNS = ['first_name', 'last_name', 'city', 'salary', 'loc']
+
+
+def test_dedupe_session_matches_dedupe_dataframe(model_config):
+    config_name = model_config('dedupe', 'mixed')
+    df = dedupe_frame(1500, 0.3, seed=1)[COLUMNS]
+
+    expected = dedupe_dataframe(df, FIELDS, config_name=config_name, canonicalize=True, n_cores=0)
+    with DedupeSession(config_name, n_cores=2) as session:
+        for _ in range(2):
+            pd.testing.assert_frame_equal(session.dedupe(df, canonicalize=True), expected)
+        sharded = session.dedupe(df, n_shards=2)
+    assert (sharded['cluster id'] == expected['cluster id']).all()
+
+
+def test_link_session_matches_link_dataframes(model_config):
+    config_name = model_config('link', 'mixed')
+    clean, messy = linked_frames(1000, 0.5, seed=1)
+
+    expected = link_dataframes(clean[COLUMNS], messy[COLUMNS], FIELDS, config_name=config_name, n_cores=0)
+    session = LinkSession(config_name, n_cores=0)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(session.link(clean[COLUMNS], messy[COLUMNS]), expected)
+
+
+def test_gazetteer_session_updates_match_a_new_session(model_config):
+    config_name = model_config('gazetteer', 'fullname')
+    clean, messy = linked_frames(1000, 0.5, seed=1)
+    clean, messy = clean[['fullname']], messy[['fullname']]
+
+    expected = gazetteer_dataframe(clean, messy, 'fullname', config_name=config_name, n_cores=0)
+    for candidates in (None, 'ngram'):
+        session = GazetteerSession(clean.iloc[:800], 'fullname', config_name=config_name, n_cores=0,
+                                   candidates=candidates)
+        session.add(clean.iloc[800:])
+        if candidates is None:
+            pd.testing.assert_frame_equal(session.search(messy), expected)
+        else:
+            # Added records are weighted by the n-grams of the first gazette,
+            # so only a session fitted on the whole gazette matches exactly
+            whole = GazetteerSession(clean, 'fullname', config_name=config_name, n_cores=0, candidates=candidates)
+            pd.testing.assert_frame_equal(whole.search(messy), gazetteer_dataframe(
+                clean, messy, 'fullname', config_name=config_name, n_cores=0, candidates=candidates))
+
+        removed = clean.index[::4]
+        session.remove(removed)
+        fresh = GazetteerSession(clean.drop(index=removed), 'fullname', config_name=config_name, n_cores=0,
+                                 candidates=candidates)
+        updated = session.search(messy, canonicalize=True)
+        assert not updated['cluster id'].isin(removed).any()
+        if candidates is None:
+            pd.testing.assert_frame_equal(updated, fresh.search(messy, canonicalize=True))
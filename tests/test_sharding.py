@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import dedupe
+
+from pandas_dedupe.dedupe_dataframe import _prepare
+from pandas_dedupe.instrumentation import PipelineStats
+from pandas_dedupe.sharding import partition_sharded
+
+from benchmarks.generators import PROFILES, dedupe_frame
+
+
+FIELDS = PROFILES['mixed']
+COLUMNS = ['first_name', 'last_name', 'city', 'salary', 'loc']
+
+
+def _clusters(clustered_dupes):
+    return {frozenset(ids) for ids, _ in clustered_dupes}
+
+
+def test_sharded_clusters_match_single_process(model_config):
+    settings_file = model_config('dedupe', 'mixed') + '_learned_settings'
+    with open(settings_file, 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=0)
+
+    _, data, _, _ = _prepare(dedupe_frame(3000, 0.3, seed=1)[COLUMNS], FIELDS,
+                             False, False, False, PipelineStats())
+    expected = _clusters(deduper.partition(data, 0.4))
+
+    for n_shards in (1, 3):
+        with ThreadPoolExecutor(max_workers=n_shards) as executor:
+            sharded = partition_sharded(deduper, data, 0.4, settings_file, n_shards, executor)
+        assert sum(len(ids) for ids, _ in sharded) == len(data)
+        assert _clusters(sharded) == expected
+
+
+def test_sharded_clusters_in_worker_processes(model_config):
+    settings_file = model_config('dedupe', 'mixed') + '_learned_settings'
+    with open(settings_file, 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=0)
+
+    _, data, _, _ = _prepare(dedupe_frame(1000, 0.3, seed=2)[COLUMNS], FIELDS,
+                             False, False, False, PipelineStats())
+    expected = _clusters(deduper.partition(data, 0.4))
+    assert _clusters(partition_sharded(deduper, data, 0.4, settings_file, 2)) == expected
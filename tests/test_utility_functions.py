@@ -0,0 +1,82 @@
+from ast import literal_eval
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pandas_dedupe.utility_functions import latlong_column, price_column
+
+
+def _baseline_latlong(column):
+    # specify_type of pandas_dedupe 1.5.0, one literal_eval per cell
+    def parse(x):
+        if x is None:
+            return None
+        try:
+            k, v = literal_eval(x)
+            return float(k), float(v)
+        except:
+            raise Exception("Make sure that LatLong columns are tuples arranged like ('lat', 'lon')")
+    return column.apply(parse)
+
+
+def _baseline_price(column):
+    try:
+        column = column.str.replace(",", "")
+        column = column.replace({None: np.nan})
+        column = column.astype(float)
+        return column.replace({np.nan: None})
+    except:
+        raise Exception('Make sure that Price columns can be converted to float.')
+
+
+def _assert_same_result(parse, baseline, values):
+    column = pd.Series(values, index=range(10, 10 + len(values)), dtype=object, name='field')
+    try:
+        expected = baseline(column)
+    except Exception as error:
+        with pytest.raises(Exception, match=str(error)[:20]):
+            parse(column)
+        return
+    pd.testing.assert_series_equal(parse(column), expected)
+
+
+@pytest.mark.parametrize('values', [
+    ['(1.5, -2.5)', '(1.5, -2.5)', '1e3, 2', ' (+1, .5,) '],
+    ['(1, 2)', None, '(3, 4)', None],
+    [None, None],
+    # Not plain pairs of numbers, parsed with literal_eval as before
+    ["('1.5', '2.5')", '(1, 2)'],
+    ['[1, 2]', '1_0, 2', '0x10, 2', '((1, 2))', "(-1, 'inf')"],
+    ['(1, 2)', '(1, 2, 3)'],
+    ['(1, 2)', '1'],
+    ['(1, 2)', ''],
+    ['abc'],
+    ['(1, 2', '(3, 4)'],
+])
+def test_latlong_column_matches_literal_eval(values):
+    _assert_same_result(latlong_column, _baseline_latlong, values)
+
+
+@pytest.mark.parametrize('values', [
+    ['1,000', '2.5', '1,000'],
+    ['1,000', None, '3'],
+    [' 12 ', '1_000', '1e3', 'inf'],
+    ['nan', '1'],
+    [None, None],
+    ['1,000', ''],
+    ['abc'],
+    ['$5', '1'],
+])
+def test_price_column_matches_baseline(values):
+    _assert_same_result(price_column, _baseline_price, values)
+
+
+def test_parsers_take_float_missing_values_and_numbers():
+    # Intended differences: the baseline raised on NaN coordinates and
+    # turned prices that were already numbers into None.
+    latlong = latlong_column(pd.Series(['(1, 2)', np.nan, (3.0, 4.0)]))
+    assert latlong.tolist() == [(1.0, 2.0), None, (3.0, 4.0)]
+
+    prices = price_column(pd.Series([1000, '2,000', np.nan], dtype=object))
+    assert prices.tolist() == [1000.0, 2000.0, None]